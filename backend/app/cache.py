@@ -0,0 +1,73 @@
+"""
+Simple in-memory TTL cache, without external dependencies
+"""
+from typing import Optional, Tuple, Any, Callable, Hashable
+from collections import OrderedDict
+import time
+import threading
+
+
+class SimpleTTLCache:
+    """Simple LRU cache with per-entry TTL, O(1) on get and set
+
+    Entries are kept in least recently used order and the oldest are evicted
+    when the cache is full; expired entries are dropped when they are read.
+    Ages are measured on the monotonic clock, unaffected by wall clock changes.
+    With maxbytes, the total size of the values (measured by sizeof) is capped
+    too, and values larger than the whole budget are not cached at all.
+    Handlers that run in the threadpool share it, so it is guarded by a lock
+    """
+
+    def __init__(self, maxsize: int = 100, ttl: int = 3600,
+                 maxbytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._cache: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key: Hashable):
+        self.nbytes -= self._cache.pop(key)[2]
+
+    def _is_full(self) -> bool:
+        return len(self._cache) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._cache[key] = (value, time.monotonic(), size)
+            self.nbytes += size
+
+            # Evict the least recently used entries
+            while self._is_full():
+                self.nbytes -= self._cache.popitem(last=False)[1][2]
+
+    def __contains__(self, key: Hashable) -> bool:
+        # A pure read: neither refreshes the entry's recency nor drops it when expired
+        entry = self._cache.get(key)
+        return entry is not None and time.monotonic() - entry[1] <= self.ttl
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.nbytes = 0
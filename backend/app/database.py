@@ -2,16 +2,19 @@
 Database connection and session management
 """
 from sqlalchemy import create_engine, MetaData
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import declarative_base, sessionmaker
 from .config import settings
 
 # Create database engine
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    # Reuse the most recently returned connection, so a burst's extra connections
+    # go idle together and the overflow ones are closed once the burst is over
+    pool_use_lifo=True
 )
 
 # Create session factory
@@ -23,7 +26,6 @@ Base = declarative_base()
 # Metadata for reflection
 metadata = MetaData()
 
-
 def get_db():
     """Dependency to get database session"""
     db = SessionLocal()
@@ -33,6 +35,12 @@ def get_db():
         db.close()
 
 
+def get_conn():
+    """Dependency to get a plain Core connection, for read-only queries that return rows, not ORM objects"""
+    with engine.connect() as conn:
+        yield conn
+
+
 def reflect_tables():
     """Reflect existing database tables"""
     metadata.reflect(bind=engine)
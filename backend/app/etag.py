@@ -0,0 +1,75 @@
+"""
+ETag revalidation for the API's JSON responses
+"""
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import hashlib
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names the given ETag"""
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))
+
+
+class ETagMiddleware:
+    """Tag successful GET JSON responses with an ETag, and answer If-None-Match with 304
+
+    The data only changes when it is edited from the desktop client, so a page that
+    polls a listing mostly gets an empty 304 back instead of the same JSON again.
+    Responses that set their own ETag, and streamed or non-JSON bodies, pass through
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start: Optional[Message] = None
+        chunks = []
+        passthrough = False
+
+        async def send_tagged(message: Message):
+            nonlocal start, passthrough
+            if passthrough or message["type"] not in ("http.response.start", "http.response.body"):
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (message["status"] != 200 or "etag" in headers
+                        or headers.get("content-type") != "application/json"):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers = MutableHeaders(raw=start["headers"])
+            headers["ETag"] = etag
+            if "cache-control" not in headers:
+                # Stored, but revalidated before reuse
+                headers["Cache-Control"] = "no-cache"
+
+            if etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_tagged)
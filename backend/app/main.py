@@ -15,15 +15,17 @@ Author: PyArchInit Team
 License: GPL v2
 """
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, PlainTextResponse
+from jinja2 import FileSystemBytecodeCache
+from contextlib import asynccontextmanager
 from pathlib import Path
 import os
 
-from .config import settings
+from .config import settings, get_settings, Settings
+from .etag import ETagMiddleware
 from .routers import (
     sites_router,
     us_router,
@@ -33,6 +35,28 @@ from .routers import (
     export_router,
     auth_router
 )
+from .routers.media import storage_client
+
+# Setup templates
+BASE_DIR = Path(__file__).resolve().parent
+templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Compiled templates are kept on disk across restarts and only re-checked in debug
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = settings.DEBUG
+
+# Pages rendered by the app, compiled at startup
+PAGE_TEMPLATES = ("landing.html", "login.html", "index.html")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the page templates at startup so the first visitors don't pay for compiling them,
+    and close the storage server client at shutdown"""
+    for name in PAGE_TEMPLATES:
+        templates.env.get_template(name)
+    yield
+    await storage_client.aclose()
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -41,22 +65,23 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Setup templates
-BASE_DIR = Path(__file__).resolve().parent
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
-
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS.split(",") if settings.CORS_ORIGINS != "*" else ["*"],
+    allow_origins=settings.cors_origins_list,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Unchanged JSON responses are revalidated with an empty 304
+app.add_middleware(ETagMiddleware)
+
 # Include API routers
 app.include_router(sites_router, prefix="/api")
 app.include_router(us_router, prefix="/api")
@@ -69,7 +94,7 @@ app.include_router(auth_router, prefix="/api")
 
 # Root endpoint - serve landing page
 @app.get("/", response_class=HTMLResponse)
-async def landing(request: Request):
+async def landing(request: Request, settings: Settings = Depends(get_settings)):
     """Serve the landing/presentation page"""
     return templates.TemplateResponse("landing.html", {
         "request": request,
@@ -79,7 +104,7 @@ async def landing(request: Request):
 
 # Login page
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request):
+async def login_page(request: Request, settings: Settings = Depends(get_settings)):
     """Serve the login page"""
     return templates.TemplateResponse("login.html", {
         "request": request,
@@ -89,7 +114,7 @@ async def login_page(request: Request):
 
 # Main app (protected)
 @app.get("/app", response_class=HTMLResponse)
-async def main_app(request: Request):
+async def main_app(request: Request, settings: Settings = Depends(get_settings)):
     """Serve the main web application"""
     return templates.TemplateResponse("index.html", {
         "request": request,
@@ -98,10 +123,10 @@ async def main_app(request: Request):
     })
 
 
-@app.get("/health")
+@app.get("/health", response_class=PlainTextResponse, include_in_schema=False)
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"}
+    """Health check endpoint, polled by the platform's probes"""
+    return "ok"
 
 
 @app.get("/api")
@@ -2,14 +2,18 @@
 SQLAlchemy models for archaeological data
 These mirror the PyArchInit database schema (Supabase version)
 """
-from sqlalchemy import Column, Integer, BigInteger, String, Text, Float, Numeric, DateTime, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, BigInteger, String, Text, Numeric, Index
 from ..database import Base
+from ..pagination import sort_keys
 
 
 class Site(Base):
     """Archaeological site"""
     __tablename__ = 'site_table'
+    __table_args__ = (
+        # Lookup by site name
+        Index('ix_site_table_sito', 'sito'),
+    )
 
     id_sito = Column(BigInteger, primary_key=True)
     sito = Column(Text)
@@ -26,6 +30,10 @@ class Site(Base):
 class US(Base):
     """Stratigraphic Unit"""
     __tablename__ = 'us_table'
+    __table_args__ = (
+        # Listing and export order
+        Index('ix_us_table_sito_area_us', 'sito', 'area', 'us'),
+    )
 
     id_us = Column(BigInteger, primary_key=True)
     sito = Column(Text)
@@ -125,9 +133,23 @@ class US(Base):
     uso_primario_usm = Column(Text)
 
 
+# Sort keys of the paginated listing (US_ORDER), so that a cursor page seeks to its first row
+Index('ix_us_table_keyset', *sort_keys((US.sito, US.area, US.us, US.id_us)))
+
+
 class InventarioMateriali(Base):
     """Materials inventory"""
     __tablename__ = 'inventario_materiali_table'
+    __table_args__ = (
+        # Export order, also serves the per-site filter
+        Index('ix_inventario_materiali_table_sito_numero_inventario', 'sito', 'numero_inventario'),
+        # Box listings, grouped by storage location and box
+        Index('ix_inventario_materiali_table_luogo_conservazione_nr_cassa', 'luogo_conservazione', 'nr_cassa'),
+        # Optional list filters
+        Index('ix_inventario_materiali_table_nr_cassa', 'nr_cassa'),
+        Index('ix_inventario_materiali_table_tipo_reperto', 'tipo_reperto'),
+        Index('ix_inventario_materiali_table_area_us', 'area', 'us'),
+    )
 
     id_invmat = Column(BigInteger, primary_key=True)
     sito = Column(Text)
@@ -167,6 +189,10 @@ class InventarioMateriali(Base):
 class Pottery(Base):
     """Pottery records"""
     __tablename__ = 'pottery_table'
+    __table_args__ = (
+        # Export order, also serves the per-site filter
+        Index('ix_pottery_table_sito_id_number', 'sito', 'id_number'),
+    )
 
     id_rep = Column(BigInteger, primary_key=True)
     id_number = Column(BigInteger)
@@ -202,6 +228,10 @@ class Pottery(Base):
     sector = Column(Text)
 
 
+# Sort keys of the paginated listing (POTTERY_ORDER), so that a cursor page seeks to its first row
+Index('ix_pottery_table_keyset', *sort_keys((Pottery.sito, Pottery.id_number, Pottery.id_rep)))
+
+
 class USView(Base):
     """US View with geometry - read only view for checking if US has GIS geometry"""
     __tablename__ = 'pyarchinit_us_view'
@@ -1,7 +1,7 @@
 """
 SQLAlchemy model for User authentication
 """
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime
+from sqlalchemy import Column, BigInteger, String, Boolean, DateTime, Index, Identity
 from sqlalchemy.sql import func
 from ..database import Base
 
@@ -10,8 +10,8 @@ class User(Base):
     """User account for authentication"""
     __tablename__ = 'users'
 
-    id = Column(BigInteger, primary_key=True)
-    username = Column(String(100), unique=True, nullable=False, index=True)
+    id = Column(BigInteger, Identity(always=False, start=1, cache=50), primary_key=True)
+    username = Column(String(100), unique=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
     email = Column(String(255))
     full_name = Column(String(255))
@@ -19,3 +19,7 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+# Usernames are looked up case-insensitively
+Index('ix_users_username_lower', func.lower(User.username), unique=True)
@@ -0,0 +1,65 @@
+"""
+Keyset pagination helpers, for listings paged by cursor instead of OFFSET
+"""
+from fastapi import HTTPException
+from sqlalchemy import func, tuple_
+import base64
+import json
+
+# Stand-ins for NULL in the sort keys, by the column's Python type: a key without
+# NULLs compares as a row value, which an index on the same expressions serves as
+# a range. NULLs sort first, with the empty string or -1
+NULL_KEYS = {str: '', int: -1}
+
+
+def sort_keys(order) -> tuple:
+    """Sort expressions of a column order, the last column being the primary key, never NULL"""
+    *columns, primary_key = order
+    return tuple(func.coalesce(column, NULL_KEYS[column.type.python_type]) for column in columns) + (primary_key,)
+
+
+def sort_key_values(values, order) -> list:
+    """The values of an order's columns as the sort keys have them"""
+    return [
+        NULL_KEYS[column.type.python_type] if value is None else value
+        for column, value in zip(order, values)
+    ]
+
+
+def encode_cursor(row, order) -> str:
+    """Opaque cursor pointing just past a row, for a listing in the given column order"""
+    key = sort_key_values([getattr(row, column.key) for column in order], order)
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def is_key_value(value, column) -> bool:
+    """Whether a cursor value can be compared with a column: None, or a value of its type
+    that the database accepts (text without NUL characters, an integer that is not a bool)"""
+    if value is None:
+        return True
+    if isinstance(value, bool) or not isinstance(value, column.type.python_type):
+        return False
+    return not isinstance(value, str) or '\x00' not in value
+
+
+def decode_cursor(cursor: str, order) -> list:
+    """Sort key of a cursor, 400 if it is not one of ours
+
+    Each value is checked against its column, so that a tampered cursor never reaches
+    the database; the order's last column is an integer primary key, which makes the key unique
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+    if (
+        not isinstance(key, list) or len(key) != len(order) or not isinstance(key[-1], int)
+        or not all(is_key_value(value, column) for column, value in zip(order, key))
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_key_values(key, order)
+
+
+def after_cursor(cursor: str, order):
+    """Condition selecting the rows after a cursor's row, in the order's sort keys"""
+    return tuple_(*sort_keys(order)) > tuple_(*decode_cursor(cursor, order))
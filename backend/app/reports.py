@@ -0,0 +1,414 @@
+"""
+Excel and PDF rendering for data exports
+Imported by the export routes on first use, so xlsxwriter and reportlab are
+only loaded by processes that actually export
+"""
+from typing import IO, Iterable, Iterator, Optional
+import tempfile
+from itertools import groupby
+from operator import attrgetter
+
+from xlsxwriter import Workbook
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.enums import TA_CENTER
+from reportlab.pdfgen import canvas
+
+# Exports larger than this spill from memory to a temporary file on disk
+EXPORT_SPOOL_SIZE = 16 * 1024 * 1024
+# Size of the chunks sent to the client when streaming an export
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Excel cell formats, registered on each workbook by add_excel_formats
+EXCEL_FORMATS = {
+    'header': {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4472C4', 'border': 1,
+               'align': 'center', 'valign': 'vcenter', 'text_wrap': True},
+    'table_header': {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4472C4', 'border': 1},
+    'data': {'border': 1, 'text_wrap': True},
+    'cell': {'border': 1},
+    'title': {'bold': True, 'font_size': 14},
+    'section': {'bold': True, 'font_size': 12},
+    'storage': {'bold': True, 'font_size': 12, 'bg_color': '#D9E2F3'},
+}
+
+# Rows are flushed to disk as they are written; cell text is always stored as text
+EXCEL_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_formulas': False,
+    'strings_to_urls': False,
+}
+
+# PDF styles, built once at import instead of on every export
+PDF_STYLES = getSampleStyleSheet()
+PDF_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=PDF_STYLES['Heading1'],
+    fontSize=16,
+    alignment=TA_CENTER,
+    spaceAfter=20
+)
+PDF_SUMMARY_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=PDF_STYLES['Heading1'],
+    fontSize=18,
+    alignment=TA_CENTER,
+    spaceAfter=20
+)
+PDF_SECTION_STYLE = ParagraphStyle(
+    'Section',
+    parent=PDF_STYLES['Heading2'],
+    fontSize=12,
+    spaceBefore=15,
+    spaceAfter=10
+)
+
+# Data table layout drawn directly on the canvas, matching the Platypus tables
+PDF_PAGE_SIZE = landscape(A4)
+PDF_MARGIN = 1*cm
+PDF_TOP_MARGIN = 1.5*cm
+PDF_FRAME_PADDING = 6
+PDF_ROW_HEIGHT = 18
+PDF_CELL_PADDING = 6
+PDF_HEADER_FONT_SIZE = 8
+PDF_DATA_FONT_SIZE = 7
+PDF_HEADER_COLOR = colors.HexColor('#4472C4')
+PDF_STRIPE_COLOR = colors.HexColor('#E9EDF4')
+
+PDF_STATS_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+PDF_CATEGORY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PDF_HEADER_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, PDF_STRIPE_COLOR]),
+])
+PDF_BOX_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PDF_HEADER_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ALIGN', (0, 0), (1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, PDF_STRIPE_COLOR]),
+])
+
+
+# Summary table column widths, in points
+PDF_STATS_COL_WIDTHS = (150, 100)
+PDF_CATEGORY_COL_WIDTHS = (200, 80)
+PDF_BOX_COL_WIDTHS = (60, 50, 300, 60)
+
+
+def export_buffer() -> IO[bytes]:
+    """Binary buffer for a rendered export, spooled to disk once it gets large"""
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+
+
+def iter_export(output: IO[bytes]) -> Iterator[bytes]:
+    """Stream a rendered export in fixed-size chunks, closing the buffer when done"""
+    with output:
+        while chunk := output.read(EXPORT_CHUNK_SIZE):
+            yield chunk
+
+
+def pdf_row_formatter(get_values):
+    """Wrap a row getter into a formatter turning a data row into (truncated) PDF cell strings"""
+    def format_row(row_data) -> list:
+        cells = []
+        for value in get_values(row_data):
+            if value is None:
+                cells.append("")
+            else:
+                text = value if type(value) is str else str(value)
+                cells.append(text[:47] + "..." if len(text) > 50 else text)
+        return cells
+
+    return format_row
+
+
+def add_excel_formats(wb: Workbook) -> dict:
+    """Register the export cell formats on a workbook, keyed by name"""
+    return {name: wb.add_format(properties) for name, properties in EXCEL_FORMATS.items()}
+
+
+def set_column_widths(ws, columns: list) -> None:
+    """Apply the widths declared on the export columns, never narrower than the header"""
+    for col_idx, column in enumerate(columns):
+        ws.set_column(col_idx, col_idx, max(column['width'], len(column['label']) + 2))
+
+
+def create_excel_workbook(data: Iterable, columns: list, title: str, get_values) -> IO[bytes]:
+    """Create an Excel workbook from data, flushing each row to disk as it is written
+
+    get_values returns the row's values in column order (see routers.export.row_getter)
+    """
+    output = export_buffer()
+    wb = Workbook(output, EXCEL_OPTIONS)
+    formats = add_excel_formats(wb)
+    ws = wb.add_worksheet(title[:31])  # Excel sheet name limit
+
+    set_column_widths(ws, columns)
+    ws.freeze_panes(1, 0)
+
+    # Write headers
+    ws.write_row(0, 0, [column['label'] for column in columns], formats['header'])
+
+    # Write data, one row at a time straight from the query result
+    data_format = formats['data']
+    for row_idx, row_data in enumerate(data, 1):
+        ws.write_row(row_idx, 0, get_values(row_data), data_format)
+
+    wb.close()
+    output.seek(0)
+    return output
+
+
+def create_pdf_document(data: list, columns: list, title: str, get_values, generated: str) -> IO[bytes]:
+    """Create a PDF document from data
+
+    The table is drawn straight onto the canvas: every row has the same height,
+    so pages are filled row by row instead of Platypus measuring and splitting
+    one huge Table, which grows quadratically with the number of rows
+    """
+    output = export_buffer()
+    page_width, page_height = PDF_PAGE_SIZE
+    pdf = canvas.Canvas(output, pagesize=PDF_PAGE_SIZE)
+
+    # Column positions, computed once
+    col_width = (page_width - 2 * PDF_MARGIN) / len(columns)
+    col_x = [PDF_MARGIN + col_idx * col_width for col_idx in range(len(columns))]
+    table_right = PDF_MARGIN + col_width * len(columns)
+    text_offset = (PDF_ROW_HEIGHT - PDF_DATA_FONT_SIZE) / 2 + 1
+
+    def draw_header(top: float) -> float:
+        pdf.setFillColor(PDF_HEADER_COLOR)
+        pdf.rect(PDF_MARGIN, top - PDF_ROW_HEIGHT, table_right - PDF_MARGIN, PDF_ROW_HEIGHT, stroke=0, fill=1)
+        pdf.setFillColor(colors.whitesmoke)
+        pdf.setFont('Helvetica-Bold', PDF_HEADER_FONT_SIZE)
+        baseline = top - PDF_ROW_HEIGHT + (PDF_ROW_HEIGHT - PDF_HEADER_FONT_SIZE) / 2 + 1
+        for x, column in zip(col_x, columns):
+            pdf.drawCentredString(x + col_width / 2, baseline, column['label'])
+        return top - PDF_ROW_HEIGHT
+
+    def draw_grid(top: float, bottom: float) -> None:
+        pdf.setStrokeColor(colors.grey)
+        pdf.setLineWidth(0.5)
+        y = top
+        while y >= bottom - 0.01:
+            pdf.line(PDF_MARGIN, y, table_right, y)
+            y -= PDF_ROW_HEIGHT
+        for x in col_x + [table_right]:
+            pdf.line(x, top, x, bottom)
+
+    page_top = page_height - PDF_TOP_MARGIN - PDF_FRAME_PADDING
+    page_bottom = PDF_MARGIN + PDF_FRAME_PADDING
+
+    # Title block on the first page
+    y = page_top
+    pdf.setFillColor(colors.black)
+    pdf.setFont('Helvetica-Bold', PDF_TITLE_STYLE.fontSize)
+    pdf.drawCentredString(page_width / 2, y - PDF_TITLE_STYLE.fontSize, title)
+    y -= PDF_TITLE_STYLE.leading + PDF_TITLE_STYLE.spaceAfter
+    pdf.setFont('Helvetica', 10)
+    pdf.drawString(PDF_MARGIN + PDF_FRAME_PADDING, y - 10, f"Generated on: {generated}")
+    y -= 12 + 20
+
+    format_row = pdf_row_formatter(get_values)
+    table_top = y
+    y = draw_header(y)
+    page_row = 0
+    for row_data in data:
+        if y - PDF_ROW_HEIGHT < page_bottom:
+            draw_grid(table_top, y)
+            pdf.showPage()
+            table_top = page_top
+            y = draw_header(table_top)
+            page_row = 0
+
+        # Stripes restart on every page, as with a Table split across pages
+        if page_row % 2:
+            pdf.setFillColor(PDF_STRIPE_COLOR)
+            pdf.rect(PDF_MARGIN, y - PDF_ROW_HEIGHT, table_right - PDF_MARGIN, PDF_ROW_HEIGHT, stroke=0, fill=1)
+        pdf.setFillColor(colors.black)
+        pdf.setFont('Helvetica', PDF_DATA_FONT_SIZE)
+        baseline = y - PDF_ROW_HEIGHT + text_offset
+        for x, text in zip(col_x, format_row(row_data)):
+            if text:
+                pdf.drawString(x + PDF_CELL_PADDING, baseline, text)
+        y -= PDF_ROW_HEIGHT
+        page_row += 1
+
+    draw_grid(table_top, y)
+    pdf.save()
+    output.seek(0)
+    return output
+
+
+def create_inventory_summary_excel(box_rows: list, by_type: list, detail_rows, columns: list,
+                                   get_values, generated: str, sito: Optional[str] = None) -> IO[bytes]:
+    """Create the inventory summary workbook from per-box aggregates and the ordered item rows"""
+    output = export_buffer()
+    wb = Workbook(output, EXCEL_OPTIONS)
+    formats = add_excel_formats(wb)
+
+    # Summary sheet, written top to bottom
+    ws_summary = wb.add_worksheet("Summary")
+    ws_summary.set_column(0, 5, 18)
+    row = 0
+
+    # Title
+    ws_summary.write(row, 0, f"Warehouse Inventory Summary - {sito or 'All Sites'}", formats['title'])
+    ws_summary.write(row + 1, 0, f"Generated: {generated}")
+    row += 3
+
+    # Overall stats
+    total_items = sum(b.items for b in box_rows)
+    total_boxes = sum(1 for b in box_rows if b.box)
+    total_weight = sum(b.weight for b in box_rows)
+    total_fragments = sum(b.fragments for b in box_rows)
+
+    ws_summary.write(row, 0, "Overall Statistics", formats['section'])
+    ws_summary.write(row + 1, 0, f"Total Items: {total_items}")
+    ws_summary.write(row + 2, 0, f"Total Boxes: {total_boxes}")
+    ws_summary.write(row + 3, 0, f"Total Weight: {total_weight/1000:.2f} kg")
+    ws_summary.write(row + 4, 0, f"Total Fragments: {total_fragments}")
+    row += 6
+
+    # Category breakdown
+    ws_summary.write(row, 0, "Items by Category", formats['section'])
+    ws_summary.write_row(row + 1, 0, ["Category", "Count"], formats['table_header'])
+    row += 2
+    for tipo, count in by_type:
+        ws_summary.write_row(row, 0, (tipo, count), formats['cell'])
+        row += 1
+    row += 2
+
+    # Storage location breakdown (rows arrive ordered by storage, then box)
+    box_headers = ["Box No.", "Items", "Categories", "Weight (g)", "Fragments", "SU Range"]
+    current_storage = None
+    for box in box_rows:
+        if box.storage != current_storage:
+            if current_storage is not None:
+                row += 1  # Empty row between storage locations
+            current_storage = box.storage
+
+            # Storage location header
+            ws_summary.merge_range(row, 0, row, 5, f"Storage: {box.storage}", formats['storage'])
+            ws_summary.write_row(row + 1, 0, box_headers, formats['table_header'])
+            row += 2
+
+        if box.us_min != box.us_max:
+            us_range = f"{box.us_min}-{box.us_max}"
+        else:
+            us_range = box.us_min or "-"
+
+        ws_summary.write_row(
+            row, 0,
+            (box.box, box.items, box.types or "", round(box.weight, 2), box.fragments, us_range),
+            formats['cell']
+        )
+        row += 1
+
+    # Create detailed sheet with all items
+    ws_detail = wb.add_worksheet("All Items")
+    set_column_widths(ws_detail, columns)
+    ws_detail.freeze_panes(1, 0)
+
+    # Headers
+    ws_detail.write_row(0, 0, [column['label'] for column in columns], formats['table_header'])
+
+    # Data sorted by storage, box, inventory number
+    cell_format = formats['cell']
+    for row_idx, mat in enumerate(detail_rows, 1):
+        ws_detail.write_row(row_idx, 0, get_values(mat), cell_format)
+
+    wb.close()
+    output.seek(0)
+    return output
+
+
+def create_inventory_summary_pdf(box_rows: list, by_type: list, generated: str,
+                                 sito: Optional[str] = None) -> IO[bytes]:
+    """Create the inventory summary PDF (totals, categories, boxes by storage location) from per-box aggregates"""
+    output = export_buffer()
+    doc = SimpleDocTemplate(
+        output,
+        pagesize=PDF_PAGE_SIZE,
+        rightMargin=1*cm,
+        leftMargin=1*cm,
+        topMargin=1.5*cm,
+        bottomMargin=1*cm
+    )
+
+    elements = []
+
+    # Title
+    elements.append(Paragraph(f"Warehouse Inventory Summary - {sito or 'All Sites'}", PDF_SUMMARY_TITLE_STYLE))
+    elements.append(Paragraph(f"Generated: {generated}", PDF_STYLES['Normal']))
+    elements.append(Spacer(1, 20))
+
+    # Overall statistics
+    total_items = sum(b.items for b in box_rows)
+    total_boxes = sum(1 for b in box_rows if b.box)
+    total_weight = sum(b.weight for b in box_rows)
+    # "Not specified" is the query's placeholder for items without a location
+    storage_locations = {b.storage for b in box_rows if b.storage != "Not specified"}
+
+    stats_data = [
+        ["Total Items", str(total_items)],
+        ["Total Boxes", str(total_boxes)],
+        ["Total Weight", f"{total_weight/1000:.2f} kg"],
+        ["Storage Locations", str(len(storage_locations))]
+    ]
+
+    stats_table = Table(stats_data, colWidths=PDF_STATS_COL_WIDTHS)
+    stats_table.setStyle(PDF_STATS_TABLE_STYLE)
+    elements.append(stats_table)
+    elements.append(Spacer(1, 20))
+
+    # Category breakdown
+    elements.append(Paragraph("Items by Category", PDF_SECTION_STYLE))
+
+    cat_data = [["Category", "Count"]]
+    for tipo, count in by_type:
+        cat_data.append([tipo, str(count)])
+
+    cat_table = Table(cat_data, colWidths=PDF_CATEGORY_COL_WIDTHS)
+    cat_table.setStyle(PDF_CATEGORY_TABLE_STYLE)
+    elements.append(cat_table)
+    elements.append(Spacer(1, 20))
+
+    # Storage breakdown (rows arrive ordered by storage, then box)
+    elements.append(Paragraph("Boxes by Storage Location", PDF_SECTION_STYLE))
+
+    for storage_name, boxes in groupby(box_rows, key=attrgetter('storage')):
+        elements.append(Paragraph(f"<b>{storage_name}</b>", PDF_STYLES['Normal']))
+
+        box_data = [["Box", "Items", "Categories", "Weight"]]
+        for box in boxes:
+            box_data.append([
+                str(box.box),
+                str(box.items),
+                (box.types or "")[:40],
+                f"{box.weight:.0f}g"
+            ])
+
+        box_table = Table(box_data, colWidths=PDF_BOX_COL_WIDTHS)
+        box_table.setStyle(PDF_BOX_TABLE_STYLE)
+        elements.append(box_table)
+        elements.append(Spacer(1, 10))
+
+    doc.build(elements)
+    output.seek(0)
+    return output
@@ -3,6 +3,7 @@ Authentication routes for login and user management
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -47,8 +48,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 
 def get_user(db: Session, username: str) -> Optional[User]:
-    """Get user by username"""
-    return db.query(User).filter(User.username == username).first()
+    """Get user by username, ignoring case
+
+    Accounts created before usernames were unique regardless of case may still
+    collide; the one spelled exactly as given wins, then the oldest
+    """
+    return db.query(User).filter(func.lower(User.username) == username.lower()).order_by(
+        User.username != username, User.id
+    ).first()
 
 
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
@@ -61,7 +68,7 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     return user
 
 
-async def get_current_user(
+def get_current_user(
     token: Optional[str] = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
@@ -123,7 +130,7 @@ async def get_current_admin_user(
 
 
 @router.post("/token", response_model=Token)
-async def login_for_access_token(
+def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -143,7 +150,7 @@ async def login_for_access_token(
 
 
 @router.post("/login", response_model=Token)
-async def login(
+def login(
     login_data: UserLogin,
     db: Session = Depends(get_db)
 ):
@@ -170,7 +177,7 @@ async def get_current_user_info(
 
 
 @router.get("/users", response_model=List[UserResponse])
-async def list_users(
+def list_users(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_admin_user),
@@ -182,14 +189,14 @@ async def list_users(
 
 
 @router.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(
+def create_user(
     user_data: UserCreate,
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
     """Create a new user (admin only)"""
     # Check if username already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    existing_user = get_user(db, user_data.username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -211,7 +218,7 @@ async def create_user(
 
 
 @router.get("/users/{user_id}", response_model=UserResponse)
-async def get_user_by_id(
+def get_user_by_id(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
@@ -224,7 +231,7 @@ async def get_user_by_id(
 
 
 @router.put("/users/{user_id}", response_model=UserResponse)
-async def update_user(
+def update_user(
     user_id: int,
     user_data: UserUpdate,
     current_user: User = Depends(get_current_admin_user),
@@ -253,7 +260,7 @@ async def update_user(
 
 
 @router.delete("/users/{user_id}")
-async def delete_user(
+def delete_user(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
@@ -1,775 +1,632 @@
 """
 API routes for exporting data to PDF and Excel
 """
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
+from sqlalchemy import select, func, distinct, literal, any_, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from sqlalchemy.engine import Connection
 from typing import Optional, List
-import io
 from datetime import datetime
-from collections import defaultdict
-
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm, mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
+import re
+import csv
+import io
+import hashlib
+from itertools import chain
+from operator import itemgetter
 
-from ..database import get_db
+from ..database import engine, get_conn
+from ..cache import SimpleTTLCache
 from ..models import US, InventarioMateriali, Pottery, Site
 
 router = APIRouter(prefix="/export", tags=["Export"])
 
+# US Export columns
+US_COLUMNS = [
+    {'field': 'sito', 'label': 'Site', 'width': 15},
+    {'field': 'area', 'label': 'Area', 'width': 8},
+    {'field': 'us', 'label': 'SU', 'width': 8},
+    {'field': 'd_stratigrafica', 'label': 'Strat. Definition', 'width': 25},
+    {'field': 'd_interpretativa', 'label': 'Interpretation', 'width': 25},
+    {'field': 'periodo_iniziale', 'label': 'Period', 'width': 10},
+    {'field': 'fase_iniziale', 'label': 'Phase', 'width': 10},
+    {'field': 'datazione', 'label': 'Dating', 'width': 20},
+    {'field': 'descrizione', 'label': 'Description', 'width': 50},
+    {'field': 'interpretazione', 'label': 'Interpretation Notes', 'width': 50},
+]
+
+# Materials Export columns
+MATERIALI_COLUMNS = [
+    {'field': 'sito', 'label': 'Site', 'width': 15},
+    {'field': 'numero_inventario', 'label': 'Inv. No.', 'width': 10},
+    {'field': 'tipo_reperto', 'label': 'Type', 'width': 18},
+    {'field': 'definizione', 'label': 'Definition', 'width': 25},
+    {'field': 'area', 'label': 'Area', 'width': 8},
+    {'field': 'us', 'label': 'SU', 'width': 8},
+    {'field': 'nr_cassa', 'label': 'Box No.', 'width': 9},
+    {'field': 'luogo_conservazione', 'label': 'Storage Location', 'width': 20},
+    {'field': 'stato_conservazione', 'label': 'Condition', 'width': 15},
+    {'field': 'datazione_reperto', 'label': 'Dating', 'width': 18},
+    {'field': 'totale_frammenti', 'label': 'Tot. Fragments', 'width': 15},
+    {'field': 'peso', 'label': 'Weight (g)', 'width': 12},
+]
+
+# Pottery Export columns - updated for pottery_table structure
+POTTERY_COLUMNS = [
+    {'field': 'sito', 'label': 'Site', 'width': 15},
+    {'field': 'id_number', 'label': 'ID', 'width': 8},
+    {'field': 'area', 'label': 'Area', 'width': 8},
+    {'field': 'us', 'label': 'SU', 'width': 8},
+    {'field': 'form', 'label': 'Form', 'width': 18},
+    {'field': 'specific_form', 'label': 'Specific Form', 'width': 20},
+    {'field': 'material', 'label': 'Material', 'width': 15},
+    {'field': 'fabric', 'label': 'Fabric', 'width': 15},
+    {'field': 'ware', 'label': 'Ware', 'width': 15},
+    {'field': 'box', 'label': 'Box', 'width': 8},
+    {'field': 'qty', 'label': 'Quantity', 'width': 10},
+    {'field': 'note', 'label': 'Notes', 'width': 50},
+]
+
+
+# PDF pages are narrower, so they show only the leading columns
+US_PDF_COLUMNS = US_COLUMNS[:8]
+MATERIALI_PDF_COLUMNS = MATERIALI_COLUMNS[:10]
+POTTERY_PDF_COLUMNS = POTTERY_COLUMNS[:9]
+
+
+def row_getter(columns: list):
+    """Compile a getter returning a row's values for the given columns as a tuple
+
+    Export SELECTs list their columns in declaration order and the PDF column
+    sets are prefixes of them, so values are sliced by position instead of
+    being looked up by name on each Row
+    """
+    return itemgetter(slice(0, len(columns)))
+
+
+# Row getters, compiled once and shared by every export of the same columns
+US_GETTER = row_getter(US_COLUMNS)
+US_PDF_GETTER = row_getter(US_PDF_COLUMNS)
+MATERIALI_GETTER = row_getter(MATERIALI_COLUMNS)
+MATERIALI_PDF_GETTER = row_getter(MATERIALI_PDF_COLUMNS)
+POTTERY_GETTER = row_getter(POTTERY_COLUMNS)
+POTTERY_PDF_GETTER = row_getter(POTTERY_PDF_COLUMNS)
+
+# Rows fetched per round trip when an export streams straight from a server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+# Comma-separated ids of a selection export: whole numeric tokens, surrounding spaces allowed
+EXPORT_ID_RE = re.compile(r'(?:^|,)\s*(\d+)\s*(?=,|$)', re.ASCII)
+
+# Largest selection a search export accepts
+MAX_EXPORT_IDS = 10000
+
+
+def select_fields(model, fields: list):
+    """Core SELECT of only the given model fields, returning lightweight rows"""
+    return select(*[getattr(model, field) for field in dict.fromkeys(fields)])
+
+
+def column_fields(columns: list) -> list:
+    """Field names of an export column definition"""
+    return [column['field'] for column in columns]
+
+
+# Base SELECTs of the exported columns, built once and refined per request
+US_SELECT = select_fields(US, column_fields(US_COLUMNS))
+MATERIALI_SELECT = select_fields(InventarioMateriali, column_fields(MATERIALI_COLUMNS))
+POTTERY_SELECT = select_fields(Pottery, column_fields(POTTERY_COLUMNS))
+
+
+def apply_filters(query, model, filters: dict):
+    """Add an equality condition on the model's table column for every filter that was given
+
+    The conditions go into a single WHERE call, so the statement is copied
+    once instead of once per filter
+    """
+    table_columns = model.__table__.c
+    conditions = [table_columns[field] == value for field, value in filters.items() if value]
+    return query.where(*conditions) if conditions else query
+
+
+def stream_export_rows(conn: Connection, query):
+    """Stream a query's rows from a server-side cursor in batches, 404 if there are none"""
+    result = conn.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    first = result.fetchone()
+    if first is None:
+        result.close()
+        raise HTTPException(status_code=404, detail="No data to export")
+    return chain((first,), result)
+
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Rendered exports, kept for repeated downloads of the same selection; records
+# are edited from the desktop client, so the TTL bounds how stale a download gets
+export_cache = SimpleTTLCache(maxsize=20, ttl=120)  # 2 min
+
+# Larger exports are streamed from their spool file and never cached
+EXPORT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Amount of CSV text buffered before it is sent to the client
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def export_cache_key(request: Request) -> str:
+    """Cache key of an export: its URL"""
+    key = f"{request.url.path}?{request.url.query}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
 
-def create_excel_workbook(data: list, columns: list, title: str) -> io.BytesIO:
-    """Create an Excel workbook from data"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = title[:31]  # Excel sheet name limit
-
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+def download_response(content: bytes, media_type: str, filename: str) -> Response:
+    """Send an export held in memory as a file download"""
+    return Response(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-    # Write headers
-    for col_idx, column in enumerate(columns, 1):
-        cell = ws.cell(row=1, column=col_idx, value=column['label'])
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
-
-    # Write data
-    for row_idx, row_data in enumerate(data, 2):
-        for col_idx, column in enumerate(columns, 1):
-            value = getattr(row_data, column['field'], None)
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
-            cell.alignment = Alignment(wrap_text=True)
-
-    # Auto-adjust column widths
-    for col_idx, column in enumerate(columns, 1):
-        max_length = len(str(column['label']))
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-            for cell in row:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[get_column_letter(col_idx)].width = adjusted_width
-
-    # Freeze header row
-    ws.freeze_panes = 'A2'
-
-    output = io.BytesIO()
-    wb.save(output)
+
+def export_response(output, media_type: str, filename: str, cache_key: str) -> Response:
+    """Send a rendered export as a file download, caching it when it is small enough"""
+    size = output.seek(0, 2)
     output.seek(0)
-    return output
+    if size > EXPORT_CACHE_MAX_BYTES:
+        from ..reports import iter_export
+        return StreamingResponse(
+            iter_export(output),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    with output:
+        content = output.read()
+    export_cache.set(cache_key, (content, media_type, filename))
+    return download_response(content, media_type, filename)
+
+
+def iter_csv(rows, columns: list, get_values):
+    """Render export rows as CSV text, yielded in chunks as the rows are read
+
+    Starts with a byte order mark so that Excel opens the file as UTF-8
+    """
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow([column['label'] for column in columns])
+    for row in rows:
+        writer.writerow(get_values(row))
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(query, columns: list, get_values, filename: str) -> StreamingResponse:
+    """Stream a query's rows to the client as a CSV download, 404 if there are none
+
+    The body is sent after the handler returns and its dependencies are closed,
+    so the rows are read on a connection of its own, released once the response is done.
+    The query and its first fetch run in the handler, so the handlers calling this
+    are plain def, run in the threadpool rather than on the event loop
+    """
+    conn = engine.connect()
+    try:
+        rows = stream_export_rows(conn, query)
+    except BaseException:
+        conn.close()
+        raise
+
+    return StreamingResponse(
+        iter_csv(rows, columns, get_values),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        background=BackgroundTask(conn.close)
+    )
+
 
+def us_export_query(sito: Optional[str], area: Optional[str], periodo: Optional[str]):
+    """Filtered, ordered SELECT shared by the SU Excel and PDF exports"""
+    filters = {'sito': sito, 'area': area, 'periodo_iniziale': periodo}
+    return apply_filters(US_SELECT, US, filters).order_by(US.sito, US.area, US.us)
 
-def create_pdf_document(data: list, columns: list, title: str) -> io.BytesIO:
-    """Create a PDF document from data"""
-    output = io.BytesIO()
 
-    # Use landscape for more columns
-    doc = SimpleDocTemplate(
-        output,
-        pagesize=landscape(A4),
-        rightMargin=1*cm,
-        leftMargin=1*cm,
-        topMargin=1.5*cm,
-        bottomMargin=1*cm
+def materiali_export_query(sito: Optional[str], nr_cassa: Optional[int],
+                           luogo_conservazione: Optional[str], tipo_reperto: Optional[str]):
+    """Filtered, ordered SELECT shared by the materials Excel and PDF exports"""
+    filters = {
+        'sito': sito,
+        'nr_cassa': nr_cassa,
+        'luogo_conservazione': luogo_conservazione,
+        'tipo_reperto': tipo_reperto
+    }
+    return apply_filters(MATERIALI_SELECT, InventarioMateriali, filters).order_by(
+        InventarioMateriali.sito, InventarioMateriali.numero_inventario
     )
 
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        alignment=TA_CENTER,
-        spaceAfter=20
+
+def materiali_ids_query(ids: str):
+    """SELECT of the materials listed in a comma-separated id string, or None if it has no valid id
+
+    The ids are bound as one array parameter (= ANY) rather than an IN list,
+    so the statement stays the same size however many rows are selected
+    """
+    id_list = list(map(int, EXPORT_ID_RE.findall(ids)))
+    if not id_list:
+        return None
+    if len(id_list) > MAX_EXPORT_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many IDs (max {MAX_EXPORT_IDS})")
+    return (
+        MATERIALI_SELECT
+        .where(InventarioMateriali.id_invmat == any_(bindparam('ids', id_list, type_=ARRAY(BigInteger))))
+        .order_by(InventarioMateriali.numero_inventario)
     )
 
-    elements = []
-
-    # Title
-    elements.append(Paragraph(title, title_style))
-    elements.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-
-    # Prepare table data
-    table_data = [[col['label'] for col in columns]]
-
-    for row_data in data:
-        row = []
-        for col in columns:
-            value = getattr(row_data, col['field'], None)
-            if value is None:
-                value = ""
-            elif len(str(value)) > 50:
-                value = str(value)[:47] + "..."
-            row.append(str(value))
-        table_data.append(row)
-
-    # Calculate column widths
-    available_width = landscape(A4)[0] - 2*cm
-    col_width = available_width / len(columns)
-    col_widths = [col_width] * len(columns)
-
-    # Create table
-    table = Table(table_data, colWidths=col_widths, repeatRows=1)
-    table.setStyle(TableStyle([
-        # Header style
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 8),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-
-        # Data style
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 7),
-        ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-
-        # Borders
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-
-        # Alternating row colors
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#E9EDF4')]),
-    ]))
-
-    elements.append(table)
-
-    # Build PDF
-    doc.build(elements)
-    output.seek(0)
-    return output
 
+def pottery_export_query(sito: Optional[str], form: Optional[str], material: Optional[str]):
+    """Filtered, ordered SELECT shared by the pottery Excel and PDF exports"""
+    filters = {'sito': sito, 'form': form, 'material': material}
+    return apply_filters(POTTERY_SELECT, Pottery, filters).order_by(Pottery.sito, Pottery.id_number)
+
+
+def box_summary_query(sito: Optional[str] = None):
+    """Per-box aggregates of the materials inventory, grouped by storage location and box"""
+    storage = func.coalesce(func.nullif(InventarioMateriali.luogo_conservazione, ''), 'Not specified').label('storage')
+    box = func.coalesce(InventarioMateriali.nr_cassa, 0).label('box')
+    tipo = InventarioMateriali.tipo_reperto
+    us = InventarioMateriali.us
+
+    query = select(
+        storage,
+        box,
+        func.count().label('items'),
+        func.string_agg(distinct(tipo), aggregate_order_by(literal(', '), tipo)).filter(tipo != '').label('types'),
+        func.coalesce(func.sum(InventarioMateriali.peso), 0).label('weight'),
+        func.coalesce(func.sum(InventarioMateriali.totale_frammenti), 0).label('fragments'),
+        func.min(us).filter(us != '').label('us_min'),
+        func.max(us).filter(us != '').label('us_max')
+    )
+    if sito:
+        query = query.where(InventarioMateriali.sito == sito)
 
-# US Export columns
-US_COLUMNS = [
-    {'field': 'sito', 'label': 'Site'},
-    {'field': 'area', 'label': 'Area'},
-    {'field': 'us', 'label': 'SU'},
-    {'field': 'd_stratigrafica', 'label': 'Strat. Definition'},
-    {'field': 'd_interpretativa', 'label': 'Interpretation'},
-    {'field': 'periodo_iniziale', 'label': 'Period'},
-    {'field': 'fase_iniziale', 'label': 'Phase'},
-    {'field': 'datazione', 'label': 'Dating'},
-    {'field': 'descrizione', 'label': 'Description'},
-    {'field': 'interpretazione', 'label': 'Interpretation Notes'},
-]
+    return query.group_by(storage, box).order_by(storage, box)
 
-# Materials Export columns
-MATERIALI_COLUMNS = [
-    {'field': 'sito', 'label': 'Site'},
-    {'field': 'numero_inventario', 'label': 'Inv. No.'},
-    {'field': 'tipo_reperto', 'label': 'Type'},
-    {'field': 'definizione', 'label': 'Definition'},
-    {'field': 'area', 'label': 'Area'},
-    {'field': 'us', 'label': 'SU'},
-    {'field': 'nr_cassa', 'label': 'Box No.'},
-    {'field': 'luogo_conservazione', 'label': 'Storage Location'},
-    {'field': 'stato_conservazione', 'label': 'Condition'},
-    {'field': 'datazione_reperto', 'label': 'Dating'},
-    {'field': 'totale_frammenti', 'label': 'Tot. Fragments'},
-    {'field': 'peso', 'label': 'Weight (g)'},
-]
 
-# Pottery Export columns - updated for pottery_table structure
-POTTERY_COLUMNS = [
-    {'field': 'sito', 'label': 'Site'},
-    {'field': 'id_number', 'label': 'ID'},
-    {'field': 'area', 'label': 'Area'},
-    {'field': 'us', 'label': 'SU'},
-    {'field': 'form', 'label': 'Form'},
-    {'field': 'specific_form', 'label': 'Specific Form'},
-    {'field': 'material', 'label': 'Material'},
-    {'field': 'fabric', 'label': 'Fabric'},
-    {'field': 'ware', 'label': 'Ware'},
-    {'field': 'box', 'label': 'Box'},
-    {'field': 'qty', 'label': 'Quantity'},
-    {'field': 'note', 'label': 'Notes'},
-]
+def type_counts_query(sito: Optional[str] = None):
+    """Item counts per material type, most common first"""
+    tipo = func.coalesce(func.nullif(InventarioMateriali.tipo_reperto, ''), 'Unknown').label('tipo')
+    count = func.count().label('count')
+
+    query = select(tipo, count)
+    if sito:
+        query = query.where(InventarioMateriali.sito == sito)
+
+    return query.group_by(tipo).order_by(count.desc(), tipo)
 
 
 @router.get("/us/excel")
-async def export_us_excel(
+def export_us_excel(
+    request: Request,
     sito: Optional[str] = None,
     area: Optional[str] = None,
     periodo: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export stratigraphic units to Excel"""
-    query = db.query(US)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    if sito:
-        query = query.filter(US.sito == sito)
-    if area:
-        query = query.filter(US.area == area)
-    if periodo:
-        query = query.filter(US.periodo_iniziale == periodo)
-
-    data = query.order_by(US.sito, US.area, US.us).all()
-
-    if not data:
-        raise HTTPException(status_code=404, detail="No data to export")
+    data = stream_export_rows(conn, us_export_query(sito, area, periodo))
 
     title = f"SU_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}"
-    output = create_excel_workbook(data, US_COLUMNS, title)
+    from ..reports import create_excel_workbook
+    output = create_excel_workbook(data, US_COLUMNS, title, US_GETTER)
 
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={title}.xlsx"}
-    )
+    return export_response(output, XLSX_MEDIA_TYPE, f"{title}.xlsx", cache_key)
 
 
 @router.get("/us/pdf")
-async def export_us_pdf(
+def export_us_pdf(
+    request: Request,
     sito: Optional[str] = None,
     area: Optional[str] = None,
     periodo: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export stratigraphic units to PDF"""
-    query = db.query(US)
-
-    if sito:
-        query = query.filter(US.sito == sito)
-    if area:
-        query = query.filter(US.area == area)
-    if periodo:
-        query = query.filter(US.periodo_iniziale == periodo)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    data = query.order_by(US.sito, US.area, US.us).all()
+    data = conn.execute(us_export_query(sito, area, periodo)).all()
 
     if not data:
         raise HTTPException(status_code=404, detail="No data to export")
 
+    now = datetime.now()
     title = f"Stratigraphic Units - {sito or 'All Sites'}"
-    output = create_pdf_document(data, US_COLUMNS[:8], title)
+    from ..reports import create_pdf_document
+    output = create_pdf_document(
+        data, US_PDF_COLUMNS, title, US_PDF_GETTER, now.strftime('%Y-%m-%d %H:%M')
+    )
 
-    return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=SU_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.pdf"}
+    return export_response(output, "application/pdf", f"SU_{sito or 'all'}_{now.strftime('%Y%m%d')}.pdf", cache_key)
+
+
+@router.get("/us/csv")
+def export_us_csv(
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    periodo: Optional[str] = None
+):
+    """Export stratigraphic units to CSV, streamed row by row"""
+    return csv_response(
+        us_export_query(sito, area, periodo), US_COLUMNS, US_GETTER,
+        f"SU_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.csv"
     )
 
 
 @router.get("/materiali/excel")
-async def export_materiali_excel(
+def export_materiali_excel(
+    request: Request,
     sito: Optional[str] = None,
     nr_cassa: Optional[int] = None,
     luogo_conservazione: Optional[str] = None,
     tipo_reperto: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export materials inventory to Excel"""
-    query = db.query(InventarioMateriali)
-
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
-    if nr_cassa:
-        query = query.filter(InventarioMateriali.nr_cassa == nr_cassa)
-    if luogo_conservazione:
-        query = query.filter(InventarioMateriali.luogo_conservazione == luogo_conservazione)
-    if tipo_reperto:
-        query = query.filter(InventarioMateriali.tipo_reperto == tipo_reperto)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    data = query.order_by(InventarioMateriali.sito, InventarioMateriali.numero_inventario).all()
-
-    if not data:
-        raise HTTPException(status_code=404, detail="No data to export")
+    data = stream_export_rows(conn, materiali_export_query(sito, nr_cassa, luogo_conservazione, tipo_reperto))
 
     title = f"Materials_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}"
-    output = create_excel_workbook(data, MATERIALI_COLUMNS, title)
+    from ..reports import create_excel_workbook
+    output = create_excel_workbook(data, MATERIALI_COLUMNS, title, MATERIALI_GETTER)
 
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={title}.xlsx"}
-    )
+    return export_response(output, XLSX_MEDIA_TYPE, f"{title}.xlsx", cache_key)
 
 
 @router.get("/materiali/pdf")
-async def export_materiali_pdf(
+def export_materiali_pdf(
+    request: Request,
     sito: Optional[str] = None,
     nr_cassa: Optional[int] = None,
     luogo_conservazione: Optional[str] = None,
     tipo_reperto: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export materials inventory to PDF"""
-    query = db.query(InventarioMateriali)
-
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
-    if nr_cassa:
-        query = query.filter(InventarioMateriali.nr_cassa == nr_cassa)
-    if luogo_conservazione:
-        query = query.filter(InventarioMateriali.luogo_conservazione == luogo_conservazione)
-    if tipo_reperto:
-        query = query.filter(InventarioMateriali.tipo_reperto == tipo_reperto)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    data = query.order_by(InventarioMateriali.sito, InventarioMateriali.numero_inventario).all()
+    data = conn.execute(materiali_export_query(sito, nr_cassa, luogo_conservazione, tipo_reperto)).all()
 
     if not data:
         raise HTTPException(status_code=404, detail="No data to export")
 
+    now = datetime.now()
     title = f"Materials Inventory - {sito or 'All Sites'}"
-    output = create_pdf_document(data, MATERIALI_COLUMNS[:10], title)
+    from ..reports import create_pdf_document
+    output = create_pdf_document(
+        data, MATERIALI_PDF_COLUMNS, title, MATERIALI_PDF_GETTER, now.strftime('%Y-%m-%d %H:%M')
+    )
 
-    return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=Materials_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.pdf"}
+    return export_response(output, "application/pdf", f"Materials_{sito or 'all'}_{now.strftime('%Y%m%d')}.pdf", cache_key)
+
+
+@router.get("/materiali/csv")
+def export_materiali_csv(
+    sito: Optional[str] = None,
+    nr_cassa: Optional[int] = None,
+    luogo_conservazione: Optional[str] = None,
+    tipo_reperto: Optional[str] = None
+):
+    """Export materials inventory to CSV, streamed row by row"""
+    return csv_response(
+        materiali_export_query(sito, nr_cassa, luogo_conservazione, tipo_reperto), MATERIALI_COLUMNS, MATERIALI_GETTER,
+        f"Materials_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.csv"
     )
 
 
 @router.get("/materiali/search/excel")
-async def export_materials_search_excel(
+def export_materials_search_excel(
+    request: Request,
     ids: str = Query(..., description="Comma-separated list of material IDs"),
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export specific materials by IDs to Excel (for search results)"""
-    id_list = [int(id.strip()) for id in ids.split(',') if id.strip().isdigit()]
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    if not id_list:
+    query = materiali_ids_query(ids)
+
+    if query is None:
         raise HTTPException(status_code=400, detail="No valid IDs provided")
 
-    data = db.query(InventarioMateriali).filter(
-        InventarioMateriali.id_invmat.in_(id_list)
-    ).order_by(InventarioMateriali.numero_inventario).all()
-
-    if not data:
-        raise HTTPException(status_code=404, detail="No data to export")
+    data = stream_export_rows(conn, query)
 
     title = f"Materials_Search_{datetime.now().strftime('%Y%m%d_%H%M')}"
-    output = create_excel_workbook(data, MATERIALI_COLUMNS, title)
+    from ..reports import create_excel_workbook
+    output = create_excel_workbook(data, MATERIALI_COLUMNS, title, MATERIALI_GETTER)
 
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={title}.xlsx"}
-    )
+    return export_response(output, XLSX_MEDIA_TYPE, f"{title}.xlsx", cache_key)
 
 
 @router.get("/materiali/search/pdf")
-async def export_materials_search_pdf(
+def export_materials_search_pdf(
+    request: Request,
     ids: str = Query(..., description="Comma-separated list of material IDs"),
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export specific materials by IDs to PDF (for search results)"""
-    id_list = [int(id.strip()) for id in ids.split(',') if id.strip().isdigit()]
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    if not id_list:
+    query = materiali_ids_query(ids)
+
+    if query is None:
         raise HTTPException(status_code=400, detail="No valid IDs provided")
 
-    data = db.query(InventarioMateriali).filter(
-        InventarioMateriali.id_invmat.in_(id_list)
-    ).order_by(InventarioMateriali.numero_inventario).all()
+    data = conn.execute(query).all()
 
     if not data:
         raise HTTPException(status_code=404, detail="No data to export")
 
+    now = datetime.now()
     title = f"Materials Search Results - {len(data)} items"
-    output = create_pdf_document(data, MATERIALI_COLUMNS[:10], title)
-
-    return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=Materials_Search_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"}
+    from ..reports import create_pdf_document
+    output = create_pdf_document(
+        data, MATERIALI_PDF_COLUMNS, title, MATERIALI_PDF_GETTER, now.strftime('%Y-%m-%d %H:%M')
     )
 
+    return export_response(output, "application/pdf", f"Materials_Search_{now.strftime('%Y%m%d_%H%M')}.pdf", cache_key)
+
 
 @router.get("/pottery/excel")
-async def export_pottery_excel(
+def export_pottery_excel(
+    request: Request,
     sito: Optional[str] = None,
     form: Optional[str] = None,
     material: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export pottery to Excel"""
-    query = db.query(Pottery)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    if form:
-        query = query.filter(Pottery.form == form)
-    if material:
-        query = query.filter(Pottery.material == material)
-
-    data = query.order_by(Pottery.sito, Pottery.id_number).all()
-
-    if not data:
-        raise HTTPException(status_code=404, detail="No data to export")
+    data = stream_export_rows(conn, pottery_export_query(sito, form, material))
 
     title = f"Pottery_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}"
-    output = create_excel_workbook(data, POTTERY_COLUMNS, title)
+    from ..reports import create_excel_workbook
+    output = create_excel_workbook(data, POTTERY_COLUMNS, title, POTTERY_GETTER)
 
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={title}.xlsx"}
-    )
+    return export_response(output, XLSX_MEDIA_TYPE, f"{title}.xlsx", cache_key)
 
 
 @router.get("/pottery/pdf")
-async def export_pottery_pdf(
+def export_pottery_pdf(
+    request: Request,
     sito: Optional[str] = None,
     form: Optional[str] = None,
     material: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export pottery to PDF"""
-    query = db.query(Pottery)
-
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    if form:
-        query = query.filter(Pottery.form == form)
-    if material:
-        query = query.filter(Pottery.material == material)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    data = query.order_by(Pottery.sito, Pottery.id_number).all()
+    data = conn.execute(pottery_export_query(sito, form, material)).all()
 
     if not data:
         raise HTTPException(status_code=404, detail="No data to export")
 
+    now = datetime.now()
     title = f"Pottery - {sito or 'All Sites'}"
-    output = create_pdf_document(data, POTTERY_COLUMNS[:9], title)
+    from ..reports import create_pdf_document
+    output = create_pdf_document(
+        data, POTTERY_PDF_COLUMNS, title, POTTERY_PDF_GETTER, now.strftime('%Y-%m-%d %H:%M')
+    )
 
-    return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=Pottery_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.pdf"}
+    return export_response(output, "application/pdf", f"Pottery_{sito or 'all'}_{now.strftime('%Y%m%d')}.pdf", cache_key)
+
+
+@router.get("/pottery/csv")
+def export_pottery_csv(
+    sito: Optional[str] = None,
+    form: Optional[str] = None,
+    material: Optional[str] = None
+):
+    """Export pottery to CSV, streamed row by row"""
+    return csv_response(
+        pottery_export_query(sito, form, material), POTTERY_COLUMNS, POTTERY_GETTER,
+        f"Pottery_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}.csv"
     )
 
 
 @router.get("/inventory/summary/excel")
-async def export_inventory_summary_excel(
+def export_inventory_summary_excel(
+    request: Request,
     sito: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export detailed inventory summary (boxes and storage) to Excel"""
-    query = db.query(InventarioMateriali)
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    all_materials = query.all()
+    # Per-box aggregates are computed by the database
+    box_rows = conn.execute(box_summary_query(sito)).all()
 
-    if not all_materials:
+    if not box_rows:
         raise HTTPException(status_code=404, detail="No data to export")
 
-    # Group by storage and box
-    storage_data = defaultdict(lambda: defaultdict(list))
-    for mat in all_materials:
-        storage = mat.luogo_conservazione or "Not specified"
-        box = mat.nr_cassa or 0
-        storage_data[storage][box].append(mat)
-
-    wb = Workbook()
-
-    # Summary sheet
-    ws_summary = wb.active
-    ws_summary.title = "Summary"
-
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    storage_font = Font(bold=True, size=12)
-    storage_fill = PatternFill(start_color="D9E2F3", end_color="D9E2F3", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    by_type = conn.execute(type_counts_query(sito)).all()
 
-    row = 1
-
-    # Title
-    ws_summary.cell(row=row, column=1, value=f"Warehouse Inventory Summary - {sito or 'All Sites'}")
-    ws_summary.cell(row=row, column=1).font = Font(bold=True, size=14)
-    row += 1
-    ws_summary.cell(row=row, column=1, value=f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    row += 2
-
-    # Overall stats
-    total_items = len(all_materials)
-    total_boxes = len(set((m.luogo_conservazione, m.nr_cassa) for m in all_materials if m.nr_cassa))
-    total_weight = sum(m.peso or 0 for m in all_materials)
-    total_fragments = sum(m.totale_frammenti or 0 for m in all_materials)
-
-    ws_summary.cell(row=row, column=1, value="Overall Statistics")
-    ws_summary.cell(row=row, column=1).font = storage_font
-    row += 1
-    ws_summary.cell(row=row, column=1, value=f"Total Items: {total_items}")
-    row += 1
-    ws_summary.cell(row=row, column=1, value=f"Total Boxes: {total_boxes}")
-    row += 1
-    ws_summary.cell(row=row, column=1, value=f"Total Weight: {total_weight/1000:.2f} kg")
-    row += 1
-    ws_summary.cell(row=row, column=1, value=f"Total Fragments: {total_fragments}")
-    row += 2
-
-    # Category breakdown
-    by_type = defaultdict(int)
-    for mat in all_materials:
-        tipo = mat.tipo_reperto or "Unknown"
-        by_type[tipo] += 1
-
-    ws_summary.cell(row=row, column=1, value="Items by Category")
-    ws_summary.cell(row=row, column=1).font = storage_font
-    row += 1
-
-    for col, header in enumerate(["Category", "Count"], 1):
-        cell = ws_summary.cell(row=row, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-    row += 1
-
-    for tipo, count in sorted(by_type.items(), key=lambda x: -x[1]):
-        ws_summary.cell(row=row, column=1, value=tipo).border = thin_border
-        ws_summary.cell(row=row, column=2, value=count).border = thin_border
-        row += 1
-
-    row += 2
-
-    # Storage location breakdown
-    for storage_name, boxes in sorted(storage_data.items()):
-        # Storage location header
-        ws_summary.cell(row=row, column=1, value=f"Storage: {storage_name}")
-        ws_summary.cell(row=row, column=1).font = storage_font
-        ws_summary.cell(row=row, column=1).fill = storage_fill
-        ws_summary.merge_cells(start_row=row, start_column=1, end_row=row, end_column=6)
-        row += 1
-
-        # Box headers
-        headers = ["Box No.", "Items", "Categories", "Weight (g)", "Fragments", "SU Range"]
-        for col, header in enumerate(headers, 1):
-            cell = ws_summary.cell(row=row, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = thin_border
-        row += 1
-
-        # Box data
-        for box_name, materials in sorted(boxes.items()):
-            types = set(m.tipo_reperto for m in materials if m.tipo_reperto)
-            total_weight = sum(m.peso or 0 for m in materials)
-            total_fragments = sum(m.totale_frammenti or 0 for m in materials)
-            us_list = sorted(set(str(m.us) for m in materials if m.us))
-            us_range = f"{us_list[0]}-{us_list[-1]}" if len(us_list) > 1 else (us_list[0] if us_list else "-")
-
-            ws_summary.cell(row=row, column=1, value=box_name).border = thin_border
-            ws_summary.cell(row=row, column=2, value=len(materials)).border = thin_border
-            ws_summary.cell(row=row, column=3, value=", ".join(sorted(types))).border = thin_border
-            ws_summary.cell(row=row, column=4, value=round(total_weight, 2)).border = thin_border
-            ws_summary.cell(row=row, column=5, value=total_fragments).border = thin_border
-            ws_summary.cell(row=row, column=6, value=us_range).border = thin_border
-            row += 1
-
-        row += 1  # Empty row between storage locations
-
-    # Auto-adjust column widths
-    for col in range(1, 7):
-        ws_summary.column_dimensions[get_column_letter(col)].width = 18
-
-    # Create detailed sheet with all items
-    ws_detail = wb.create_sheet("All Items")
-
-    # Headers
-    for col_idx, column in enumerate(MATERIALI_COLUMNS, 1):
-        cell = ws_detail.cell(row=1, column=col_idx, value=column['label'])
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-
-    # Data sorted by storage, box, inventory number
-    sorted_materials = sorted(all_materials, key=lambda m: (
-        m.luogo_conservazione or "",
-        m.nr_cassa or 0,
-        m.numero_inventario or 0
-    ))
-
-    for row_idx, mat in enumerate(sorted_materials, 2):
-        for col_idx, column in enumerate(MATERIALI_COLUMNS, 1):
-            value = getattr(mat, column['field'], None)
-            cell = ws_detail.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
-
-    # Auto-adjust column widths
-    for col_idx, column in enumerate(MATERIALI_COLUMNS, 1):
-        ws_detail.column_dimensions[get_column_letter(col_idx)].width = 15
-
-    ws_detail.freeze_panes = 'A2'
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    title = f"Inventory_Summary_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}"
+    # Data sorted by storage, box, inventory number, streamed in batches into the sheet
+    detail_query = apply_filters(MATERIALI_SELECT, InventarioMateriali, {'sito': sito}).order_by(
+        func.coalesce(InventarioMateriali.luogo_conservazione, ''),
+        func.coalesce(InventarioMateriali.nr_cassa, 0),
+        func.coalesce(InventarioMateriali.numero_inventario, 0)
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
 
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={title}.xlsx"}
+    now = datetime.now()
+    from ..reports import create_inventory_summary_excel
+    output = create_inventory_summary_excel(
+        box_rows, by_type, conn.execute(detail_query), MATERIALI_COLUMNS, MATERIALI_GETTER,
+        now.strftime('%Y-%m-%d %H:%M'), sito
     )
 
+    title = f"Inventory_Summary_{sito or 'all'}_{now.strftime('%Y%m%d')}"
+
+    return export_response(output, XLSX_MEDIA_TYPE, f"{title}.xlsx", cache_key)
+
 
 @router.get("/inventory/summary/pdf")
-async def export_inventory_summary_pdf(
+def export_inventory_summary_pdf(
+    request: Request,
     sito: Optional[str] = None,
-    db: Session = Depends(get_db)
+    conn: Connection = Depends(get_conn)
 ):
     """Export inventory summary to PDF"""
-    query = db.query(InventarioMateriali)
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
+    cache_key = export_cache_key(request)
+    cached = export_cache.get(cache_key)
+    if cached is not None:
+        return download_response(*cached)
 
-    all_materials = query.all()
+    # Totals, categories and boxes are all computed by the database
+    box_rows = conn.execute(box_summary_query(sito)).all()
 
-    if not all_materials:
+    if not box_rows:
         raise HTTPException(status_code=404, detail="No data to export")
 
-    output = io.BytesIO()
-    doc = SimpleDocTemplate(
-        output,
-        pagesize=landscape(A4),
-        rightMargin=1*cm,
-        leftMargin=1*cm,
-        topMargin=1.5*cm,
-        bottomMargin=1*cm
-    )
+    by_type = conn.execute(type_counts_query(sito)).all()
 
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=20
-    )
-    section_style = ParagraphStyle(
-        'Section',
-        parent=styles['Heading2'],
-        fontSize=12,
-        spaceBefore=15,
-        spaceAfter=10
+    from ..reports import create_inventory_summary_pdf
+    now = datetime.now()
+    output = create_inventory_summary_pdf(
+        box_rows, by_type, now.strftime('%Y-%m-%d %H:%M'), sito
     )
 
-    elements = []
-
-    # Title
-    elements.append(Paragraph(f"Warehouse Inventory Summary - {sito or 'All Sites'}", title_style))
-    elements.append(Paragraph(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-
-    # Overall statistics
-    total_items = len(all_materials)
-    total_boxes = len(set((m.luogo_conservazione, m.nr_cassa) for m in all_materials if m.nr_cassa))
-    total_weight = sum(m.peso or 0 for m in all_materials)
-
-    stats_data = [
-        ["Total Items", str(total_items)],
-        ["Total Boxes", str(total_boxes)],
-        ["Total Weight", f"{total_weight/1000:.2f} kg"],
-        ["Storage Locations", str(len(set(m.luogo_conservazione for m in all_materials if m.luogo_conservazione)))]
-    ]
-
-    stats_table = Table(stats_data, colWidths=[150, 100])
-    stats_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(stats_table)
-    elements.append(Spacer(1, 20))
-
-    # Category breakdown
-    by_type = defaultdict(int)
-    for mat in all_materials:
-        tipo = mat.tipo_reperto or "Unknown"
-        by_type[tipo] += 1
-
-    elements.append(Paragraph("Items by Category", section_style))
-
-    cat_data = [["Category", "Count"]]
-    for tipo, count in sorted(by_type.items(), key=lambda x: -x[1]):
-        cat_data.append([tipo, str(count)])
-
-    cat_table = Table(cat_data, colWidths=[200, 80])
-    cat_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#E9EDF4')]),
-    ]))
-    elements.append(cat_table)
-    elements.append(Spacer(1, 20))
-
-    # Storage breakdown
-    storage_data = defaultdict(lambda: defaultdict(list))
-    for mat in all_materials:
-        storage = mat.luogo_conservazione or "Not specified"
-        box = mat.nr_cassa or 0
-        storage_data[storage][box].append(mat)
-
-    elements.append(Paragraph("Boxes by Storage Location", section_style))
-
-    for storage_name, boxes in sorted(storage_data.items()):
-        elements.append(Paragraph(f"<b>{storage_name}</b>", styles['Normal']))
-
-        box_data = [["Box", "Items", "Categories", "Weight"]]
-        for box_name, materials in sorted(boxes.items()):
-            types = set(m.tipo_reperto for m in materials if m.tipo_reperto)
-            total_wt = sum(m.peso or 0 for m in materials)
-            box_data.append([
-                str(box_name),
-                str(len(materials)),
-                ", ".join(sorted(types))[:40],
-                f"{total_wt:.0f}g"
-            ])
-
-        box_table = Table(box_data, colWidths=[60, 50, 300, 60])
-        box_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('ALIGN', (0, 0), (1, -1), 'CENTER'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#E9EDF4')]),
-        ]))
-        elements.append(box_table)
-        elements.append(Spacer(1, 10))
-
-    doc.build(elements)
-    output.seek(0)
-
-    title = f"Inventory_Summary_{sito or 'all'}_{datetime.now().strftime('%Y%m%d')}"
+    title = f"Inventory_Summary_{sito or 'all'}_{now.strftime('%Y%m%d')}"
 
-    return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={title}.pdf"}
-    )
+    return export_response(output, "application/pdf", f"{title}.pdf", cache_key)
@@ -1,35 +1,53 @@
 """
 API routes for Materials Inventory
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, distinct
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import func, distinct, tuple_, select, literal, union_all
 from typing import List, Optional
 from collections import defaultdict
+import orjson
 
-from ..database import get_db
+from ..database import SessionLocal, get_db
+from ..cache import SimpleTTLCache
 from ..models import InventarioMateriali
-from ..schemas import MaterialeResponse, PaginatedResponse, MaterialsSummary, StorageSummary, BoxSummary
+from ..schemas import MaterialeResponse, PaginatedResponse, MaterialsSummary, BoxSummary, paginated_orjson
 
 router = APIRouter(prefix="/materiali", tags=["Materials Inventory"])
 
-
-@router.get("/", response_model=List[MaterialeResponse])
-async def get_materiali(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=10000),
-    sito: Optional[str] = None,
-    area: Optional[str] = None,
-    us: Optional[str] = None,
-    nr_cassa: Optional[int] = None,
-    luogo_conservazione: Optional[str] = None,
-    tipo_reperto: Optional[str] = None,
-    years: Optional[List[int]] = Query(None, description="Filter by one or more years"),
-    search: Optional[str] = None,
-    db: Session = Depends(get_db)
+# Load only the columns MaterialeResponse serializes, not the unused text fields;
+# reading any other column raises instead of quietly issuing a SELECT per row
+MATERIALE_RESPONSE_COLUMNS = load_only(
+    *[getattr(InventarioMateriali, field) for field in MaterialeResponse.model_fields], raiseload=True
+)
+
+# Serialized inventory summaries, repeatedly requested by dashboard refreshes;
+# the TTL bounds how stale they get after an edit from the desktop client
+summary_cache = SimpleTTLCache(maxsize=100, ttl=60)  # 1 min
+
+# Values of the filter dropdowns, reopened on every page; records are edited from
+# the desktop client, so the TTL bounds how long a new value takes to show up
+facets_cache = SimpleTTLCache(maxsize=100, ttl=300)  # 5 min
+
+# Rows loaded per batch by the NDJSON stream
+STREAM_BATCH_SIZE = 1000
+
+
+def materiali_query(
+    db: Session,
+    sito: Optional[str],
+    area: Optional[str],
+    us: Optional[str],
+    nr_cassa: Optional[int],
+    luogo_conservazione: Optional[str],
+    tipo_reperto: Optional[str],
+    years: Optional[List[int]],
+    search: Optional[str]
 ):
-    """Get list of materials"""
-    query = db.query(InventarioMateriali)
+    """Materials matching the listing filters, shared by the list, the stream and the paginated listing"""
+    query = db.query(InventarioMateriali).options(MATERIALE_RESPONSE_COLUMNS)
 
     if sito:
         query = query.filter(InventarioMateriali.sito == sito)
@@ -51,6 +69,28 @@ async def get_materiali(
             (InventarioMateriali.definizione.ilike(f"%{search}%"))
         )
 
+    return query
+
+
+@router.get("/", response_model=List[MaterialeResponse])
+def get_materiali(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    us: Optional[str] = None,
+    nr_cassa: Optional[int] = None,
+    luogo_conservazione: Optional[str] = None,
+    tipo_reperto: Optional[str] = None,
+    years: Optional[List[int]] = Query(None, description="Filter by one or more years"),
+    search: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get list of materials"""
+    query = materiali_query(
+        db, sito, area, us, nr_cassa, luogo_conservazione, tipo_reperto, years, search
+    )
+
     materiali = query.order_by(
         InventarioMateriali.sito,
         InventarioMateriali.numero_inventario
@@ -59,8 +99,47 @@ async def get_materiali(
     return materiali
 
 
-@router.get("/paginated", response_model=PaginatedResponse)
-async def get_materiali_paginated(
+def iter_ndjson(query):
+    """Serialize a query's materials one JSON line at a time, loading them in batches"""
+    for materiale in query.yield_per(STREAM_BATCH_SIZE):
+        yield MaterialeResponse.model_validate(materiale).model_dump_json() + "\n"
+
+
+@router.get("/stream")
+def stream_materiali(
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    us: Optional[str] = None,
+    nr_cassa: Optional[int] = None,
+    luogo_conservazione: Optional[str] = None,
+    tipo_reperto: Optional[str] = None,
+    years: Optional[List[int]] = Query(None, description="Filter by one or more years"),
+    search: Optional[str] = None
+):
+    """Stream all the matching materials as NDJSON, one MaterialeResponse per line
+
+    The body is sent after the handler returns, so the rows are read on a session
+    of its own, closed once the response is done
+    """
+    db = SessionLocal()
+    query = materiali_query(
+        db, sito, area, us, nr_cassa, luogo_conservazione, tipo_reperto, years, search
+    )
+
+    query = query.order_by(
+        InventarioMateriali.sito,
+        InventarioMateriali.numero_inventario
+    )
+
+    return StreamingResponse(
+        iter_ndjson(query),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(db.close)
+    )
+
+
+@router.get("/paginated", response_model=PaginatedResponse[MaterialeResponse])
+def get_materiali_paginated(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     sito: Optional[str] = None,
@@ -74,47 +153,32 @@ async def get_materiali_paginated(
     db: Session = Depends(get_db)
 ):
     """Get paginated list of materials"""
-    query = db.query(InventarioMateriali)
-
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
-    if area:
-        query = query.filter(InventarioMateriali.area == area)
-    if us is not None:
-        query = query.filter(InventarioMateriali.us == us)
-    if nr_cassa:
-        query = query.filter(InventarioMateriali.nr_cassa == nr_cassa)
-    if luogo_conservazione:
-        query = query.filter(InventarioMateriali.luogo_conservazione == luogo_conservazione)
-    if tipo_reperto:
-        query = query.filter(InventarioMateriali.tipo_reperto == tipo_reperto)
-    if years:
-        query = query.filter(InventarioMateriali.years.in_(years))
-    if search:
-        query = query.filter(
-            (InventarioMateriali.descrizione.ilike(f"%{search}%")) |
-            (InventarioMateriali.definizione.ilike(f"%{search}%"))
-        )
-
-    total = query.count()
-    total_pages = (total + page_size - 1) // page_size
+    query = materiali_query(
+        db, sito, area, us, nr_cassa, luogo_conservazione, tipo_reperto, years, search
+    )
 
-    items = query.order_by(
+    # The page and the total count in one scan, the count as a window over the filtered rows
+    rows = query.add_columns(func.count().over().label('total')).order_by(
         InventarioMateriali.sito,
         InventarioMateriali.numero_inventario
     ).offset((page - 1) * page_size).limit(page_size).all()
 
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "total_pages": total_pages
-    }
+    items = [row[0] for row in rows]
+    if rows:
+        total = rows[0].total
+    elif page == 1:
+        total = 0
+    else:
+        # Past the last page there is no row to read the count from
+        total = query.count()
+
+    return paginated_orjson(
+        [MaterialeResponse.model_validate(materiale).model_dump() for materiale in items], total, page, page_size
+    )
 
 
 @router.get("/years", response_model=List[int])
-async def get_available_years(
+def get_available_years(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
@@ -127,7 +191,7 @@ async def get_available_years(
 
 
 @router.get("/summary", response_model=MaterialsSummary)
-async def get_materials_summary(
+def get_materials_summary(
     sito: Optional[str] = None,
     years: Optional[List[int]] = Query(None, description="Filter by one or more years"),
     db: Session = Depends(get_db)
@@ -136,82 +200,92 @@ async def get_materials_summary(
     Get comprehensive summary of materials inventory.
     Includes breakdown by storage location, boxes, and material types.
     """
-    query = db.query(InventarioMateriali)
+    cache_key = f"{sito}|{sorted(set(years)) if years else None}"
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+
+    conditions = []
     if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
+        conditions.append(InventarioMateriali.sito == sito)
     if years:
-        query = query.filter(InventarioMateriali.years.in_(years))
+        conditions.append(InventarioMateriali.years.in_(years))
+
+    # Counts and types per box, aggregated by the database
+    storage = func.coalesce(func.nullif(InventarioMateriali.luogo_conservazione, ''), "Non specificato")
+    box = func.coalesce(InventarioMateriali.nr_cassa, 0)
+    tipo = InventarioMateriali.tipo_reperto
+    box_rows = db.query(
+        storage,
+        box,
+        func.count(InventarioMateriali.id_invmat),
+        func.array_agg(distinct(tipo)).filter(tipo != '')
+    ).filter(*conditions).group_by(storage, box).all()
+
+    # Group boxes by storage location. The summary is built as plain dicts shaped
+    # as MaterialsSummary: the rows come typed from the database, so there is
+    # nothing to validate
+    storage_data = defaultdict(list)
+    for storage_name, box_number, count, types in box_rows:
+        storage_data[storage_name].append({
+            "nr_cassa": box_number,
+            "luogo_conservazione": storage_name,
+            "total_items": count,
+            "types": types or []
+        })
 
-    all_materials = query.all()
+    # Build storage summaries
+    storage_locations = [
+        {
+            "luogo_conservazione": storage_name,
+            "total_boxes": len(boxes),
+            "total_items": sum(b["total_items"] for b in boxes),
+            "boxes": sorted(boxes, key=lambda x: x["nr_cassa"])
+        }
+        for storage_name, boxes in storage_data.items()
+    ]
+
+    # Counts by type and by site, in one query
+    tipo_label = func.coalesce(func.nullif(tipo, ''), "Non specificato")
+    site_label = func.coalesce(func.nullif(InventarioMateriali.sito, ''), "Non specificato")
+    count_rows = db.query(
+        tipo_label.label('tipo'),
+        site_label.label('site'),
+        func.grouping(tipo_label).label('all_types'),
+        func.count(InventarioMateriali.id_invmat).label('count')
+    ).filter(*conditions).group_by(func.grouping_sets(tuple_(tipo_label), tuple_(site_label))).all()
 
-    # Total count
-    total_materials = len(all_materials)
+    by_type = {row.tipo: row.count for row in count_rows if not row.all_types}
+    by_site = {row.site: row.count for row in count_rows if row.all_types}
 
-    # Group by storage location
-    storage_data = defaultdict(lambda: {"boxes": defaultdict(lambda: {"items": [], "types": set()})})
+    summary = {
+        "total_materials": sum(row[2] for row in box_rows),
+        "total_boxes": len(box_rows),
+        "storage_locations": sorted(storage_locations, key=lambda x: x["luogo_conservazione"]),
+        "by_type": by_type,
+        "by_site": by_site
+    }
 
-    for mat in all_materials:
-        storage = mat.luogo_conservazione or "Non specificato"
-        box = mat.nr_cassa or "Non specificata"
-        storage_data[storage]["boxes"][box]["items"].append(mat)
-        if mat.tipo_reperto:
-            storage_data[storage]["boxes"][box]["types"].add(mat.tipo_reperto)
-
-    # Build storage summaries
-    storage_locations = []
-    total_boxes = 0
-
-    for storage_name, storage_info in storage_data.items():
-        boxes = []
-        for box_name, box_info in storage_info["boxes"].items():
-            boxes.append(BoxSummary(
-                nr_cassa=box_name if box_name != "Non specificata" else 0,
-                luogo_conservazione=storage_name,
-                total_items=len(box_info["items"]),
-                types=list(box_info["types"])
-            ))
-            total_boxes += 1
-
-        storage_locations.append(StorageSummary(
-            luogo_conservazione=storage_name,
-            total_boxes=len(boxes),
-            total_items=sum(b.total_items for b in boxes),
-            boxes=sorted(boxes, key=lambda x: x.nr_cassa if isinstance(x.nr_cassa, int) else 0)
-        ))
-
-    # Count by type
-    by_type = defaultdict(int)
-    for mat in all_materials:
-        tipo = mat.tipo_reperto or "Non specificato"
-        by_type[tipo] += 1
-
-    # Count by site
-    by_site = defaultdict(int)
-    for mat in all_materials:
-        site = mat.sito or "Non specificato"
-        by_site[site] += 1
-
-    return MaterialsSummary(
-        total_materials=total_materials,
-        total_boxes=total_boxes,
-        storage_locations=sorted(storage_locations, key=lambda x: x.luogo_conservazione),
-        by_type=dict(by_type),
-        by_site=dict(by_site)
-    )
+    # Served as is on a hit, without serializing it again
+    content = orjson.dumps(summary)
+    summary_cache.set(cache_key, content)
+    return Response(content, media_type="application/json")
 
 
 @router.get("/boxes", response_model=List[BoxSummary])
-async def get_boxes(
+def get_boxes(
     sito: Optional[str] = None,
     luogo_conservazione: Optional[str] = None,
     years: Optional[List[int]] = Query(None, description="Filter by one or more years"),
     db: Session = Depends(get_db)
 ):
     """Get list of boxes with item counts"""
+    tipo = InventarioMateriali.tipo_reperto
     query = db.query(
         InventarioMateriali.nr_cassa,
         InventarioMateriali.luogo_conservazione,
-        func.count(InventarioMateriali.id_invmat).label('count')
+        func.count(InventarioMateriali.id_invmat).label('count'),
+        func.array_agg(distinct(tipo)).filter(tipo != '').label('types')
     )
 
     if sito:
@@ -221,113 +295,141 @@ async def get_boxes(
     if years:
         query = query.filter(InventarioMateriali.years.in_(years))
 
+    # Types are collected in the same GROUP BY, no extra query per box
     results = query.group_by(
         InventarioMateriali.nr_cassa,
         InventarioMateriali.luogo_conservazione
     ).all()
 
-    boxes = []
-    for r in results:
-        if r[0]:  # Skip null box numbers
-            # Get types in this box
-            types_query = db.query(distinct(InventarioMateriali.tipo_reperto)).filter(
-                InventarioMateriali.nr_cassa == r[0]
-            )
-            if sito:
-                types_query = types_query.filter(InventarioMateriali.sito == sito)
-            if years:
-                types_query = types_query.filter(InventarioMateriali.years.in_(years))
-            types = [t[0] for t in types_query.all() if t[0]]
-
-            boxes.append(BoxSummary(
-                nr_cassa=r[0],
-                luogo_conservazione=r[1],
-                total_items=r[2],
-                types=types
-            ))
-
-    return sorted(boxes, key=lambda x: x.nr_cassa if isinstance(x.nr_cassa, int) else 0)
+    boxes = [
+        BoxSummary.model_construct(
+            nr_cassa=r.nr_cassa,
+            luogo_conservazione=r.luogo_conservazione,
+            total_items=r.count,
+            types=r.types or []
+        )
+        for r in results
+        if r.nr_cassa  # Skip null box numbers
+    ]
+
+    return sorted(boxes, key=lambda x: x.nr_cassa)
 
 
 @router.get("/storage-locations", response_model=List[str])
-async def get_storage_locations(
+def get_storage_locations(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of storage locations"""
+    cache_key = f"storage|{sito}"
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = db.query(distinct(InventarioMateriali.luogo_conservazione))
     if sito:
         query = query.filter(InventarioMateriali.sito == sito)
     locations = query.all()
-    return [loc[0] for loc in locations if loc[0]]
+    result = [loc[0] for loc in locations if loc[0]]
+    facets_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/types", response_model=List[str])
-async def get_material_types(
+def get_material_types(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of material types"""
+    cache_key = f"types|{sito}"
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = db.query(distinct(InventarioMateriali.tipo_reperto))
     if sito:
         query = query.filter(InventarioMateriali.sito == sito)
     types = query.all()
-    return [t[0] for t in types if t[0]]
+    result = [t[0] for t in types if t[0]]
+    facets_cache.set(cache_key, result)
+    return result
 
 
-@router.get("/statistics")
-async def get_materials_statistics(
+@router.get("/facets")
+def get_materials_facets(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Get statistics about materials"""
-    query = db.query(InventarioMateriali)
-    if sito:
-        query = query.filter(InventarioMateriali.sito == sito)
-
-    total = query.count()
-
-    # Total weight
-    total_weight = db.query(func.sum(InventarioMateriali.peso))
-    if sito:
-        total_weight = total_weight.filter(InventarioMateriali.sito == sito)
-    total_weight = total_weight.scalar() or 0
+    """Get the values of the filter dropdowns (material types and storage locations) in one round trip"""
+    cache_key = f"facets|{sito}"
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    conditions = [InventarioMateriali.sito == sito] if sito else []
+    types = select(
+        literal('type').label('kind'),
+        InventarioMateriali.tipo_reperto.label('value')
+    ).where(*conditions).distinct()
+    storages = select(
+        literal('storage').label('kind'),
+        InventarioMateriali.luogo_conservazione.label('value')
+    ).where(*conditions).distinct()
+    rows = db.execute(union_all(types, storages)).all()
+
+    result = {
+        "types": [r.value for r in rows if r.kind == 'type' and r.value],
+        "storage_locations": [r.value for r in rows if r.kind == 'storage' and r.value]
+    }
+    facets_cache.set(cache_key, result)
+    return result
 
-    # Total fragments
-    total_fragments = db.query(func.sum(InventarioMateriali.totale_frammenti))
-    if sito:
-        total_fragments = total_fragments.filter(InventarioMateriali.sito == sito)
-    total_fragments = total_fragments.scalar() or 0
 
-    # Count by type
-    by_type = db.query(
-        InventarioMateriali.tipo_reperto,
-        func.count(InventarioMateriali.id_invmat).label('count')
-    )
-    if sito:
-        by_type = by_type.filter(InventarioMateriali.sito == sito)
-    by_type = by_type.group_by(InventarioMateriali.tipo_reperto).all()
+@router.get("/statistics")
+def get_materials_statistics(
+    sito: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get statistics about materials"""
+    tipo = InventarioMateriali.tipo_reperto
+    storage = InventarioMateriali.luogo_conservazione
 
-    # Count by storage
-    by_storage = db.query(
-        InventarioMateriali.luogo_conservazione,
-        func.count(InventarioMateriali.id_invmat).label('count')
+    # Totals, counts by type and counts by storage in a single scan and round trip
+    query = db.query(
+        tipo,
+        storage,
+        func.grouping(tipo).label('all_types'),
+        func.grouping(storage).label('all_storages'),
+        func.count(InventarioMateriali.id_invmat).label('count'),
+        func.sum(InventarioMateriali.peso).label('weight'),
+        func.sum(InventarioMateriali.totale_frammenti).label('fragments')
     )
     if sito:
-        by_storage = by_storage.filter(InventarioMateriali.sito == sito)
-    by_storage = by_storage.group_by(InventarioMateriali.luogo_conservazione).all()
-
+        query = query.filter(InventarioMateriali.sito == sito)
+    rows = query.group_by(func.grouping_sets(tuple_(tipo), tuple_(storage), tuple_())).all()
+
+    by_type = {}
+    by_storage = {}
+    for row in rows:
+        if row.all_types and row.all_storages:
+            totals = row
+        elif row.all_storages:
+            by_type[row.tipo_reperto or "N/A"] = row.count
+        else:
+            by_storage[row.luogo_conservazione or "N/A"] = row.count
+
+    total_weight = totals.weight or 0
     return {
-        "total": total,
+        "total": totals.count,
         "total_weight_kg": round(total_weight / 1000, 2) if total_weight else 0,
-        "total_fragments": total_fragments,
-        "by_type": {t[0] or "N/A": t[1] for t in by_type},
-        "by_storage": {s[0] or "N/A": s[1] for s in by_storage}
+        "total_fragments": totals.fragments or 0,
+        "by_type": by_type,
+        "by_storage": by_storage
     }
 
 
 @router.get("/{materiale_id}", response_model=MaterialeResponse)
-async def get_materiale(materiale_id: int, db: Session = Depends(get_db)):
+def get_materiale(materiale_id: int, db: Session = Depends(get_db)):
     """Get a specific material by ID"""
     materiale = db.query(InventarioMateriali).filter(
         InventarioMateriali.id_invmat == materiale_id
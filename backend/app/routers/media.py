@@ -3,80 +3,116 @@ API routes for Media files
 Integrates with PyArchInit Storage Server for remote media access
 With in-memory caching for improved performance
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import StreamingResponse, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response, RedirectResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional, Tuple, Dict, Any
+from sqlalchemy import func, select, literal, union_all, case, exists
+from typing import List, Optional, Tuple, Dict
 import httpx
+import hashlib
 import io
-import time
 import asyncio
+from collections import defaultdict
+from urllib.parse import quote
 
-from ..database import get_db
+from ..database import SessionLocal, get_db
 from ..models import MediaThumb, MediaToEntity
-from ..schemas import MediaResponse, get_media_category
+from ..schemas import (
+    MediaResponse, get_media_category,
+    IMAGE_MEDIATYPES, VIDEO_MEDIATYPES, MODEL_MEDIATYPES, VIDEO_EXTENSIONS, MODEL_EXTENSIONS
+)
 from ..config import settings
+from ..cache import SimpleTTLCache
+from ..etag import etag_matches
 
 router = APIRouter(prefix="/media", tags=["Media"])
 
 
-# Simple TTL Cache implementation without external dependencies
-class SimpleTTLCache:
-    """Simple TTL cache using dict with timestamp tracking"""
-
-    def __init__(self, maxsize: int = 100, ttl: int = 3600):
-        self.maxsize = maxsize
-        self.ttl = ttl
-        self._cache: Dict[str, Tuple[Any, float]] = {}
-        self._lock = asyncio.Lock()
-
-    def _is_expired(self, timestamp: float) -> bool:
-        return time.time() - timestamp > self.ttl
-
-    def _cleanup(self):
-        """Remove expired entries and enforce maxsize"""
-        now = time.time()
-        # Remove expired
-        expired_keys = [k for k, (_, ts) in self._cache.items() if now - ts > self.ttl]
-        for k in expired_keys:
-            del self._cache[k]
-
-        # Enforce maxsize - remove oldest entries
-        if len(self._cache) > self.maxsize:
-            sorted_items = sorted(self._cache.items(), key=lambda x: x[1][1])
-            for k, _ in sorted_items[:len(self._cache) - self.maxsize]:
-                del self._cache[k]
-
-    def get(self, key: str) -> Optional[Any]:
-        if key in self._cache:
-            value, timestamp = self._cache[key]
-            if not self._is_expired(timestamp):
-                return value
-            else:
-                del self._cache[key]
-        return None
-
-    def set(self, key: str, value: Any):
-        self._cleanup()
-        self._cache[key] = (value, time.time())
-
-    def __contains__(self, key: str) -> bool:
-        return self.get(key) is not None
-
-    def __len__(self) -> int:
-        self._cleanup()
-        return len(self._cache)
-
-    def clear(self):
-        self._cache.clear()
-
-
-# In-memory cache for images
-# Max 500 items, 1 hour TTL for thumbnails, 30 min for full images
-thumbnail_cache = SimpleTTLCache(maxsize=500, ttl=3600)  # 1 hour
-full_image_cache = SimpleTTLCache(maxsize=100, ttl=1800)  # 30 min
-cache_lock = asyncio.Lock()
+def image_size(image: Tuple[bytes, str, str]) -> int:
+    """Size of a cached image, for the caches' byte budgets"""
+    return len(image[0])
+
+
+# In-memory cache for proxied images, only used when Cloudinary is disabled
+# (otherwise the browser is sent to Cloudinary and images never pass through here)
+# Max 500 items / 64 MB, 1 hour TTL for thumbnails; 256 MB, 30 min for full images, whose
+# sizes vary too much for an item count to bound memory (the count only caps bookkeeping)
+thumbnail_cache: Optional[SimpleTTLCache] = None
+full_image_cache: Optional[SimpleTTLCache] = None
+if not settings.CLOUDINARY_ENABLED:
+    thumbnail_cache = SimpleTTLCache(maxsize=500, ttl=3600, maxbytes=64 * 1024 * 1024, sizeof=image_size)  # 1 hour
+    full_image_cache = SimpleTTLCache(maxsize=10000, ttl=1800, maxbytes=256 * 1024 * 1024, sizeof=image_size)  # 30 min
+
+# Larger full images are streamed to the client as they arrive and never cached,
+# so they are not held in memory whole
+FULL_IMAGE_MAX_BUFFERED = 2 * 1024 * 1024  # 2 MB
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# get_media_category as a SQL expression, for filtering and counting by category in the database
+_mediatype = func.lower(func.trim(MediaThumb.mediatype))
+_extension = case(
+    (func.coalesce(MediaThumb.filetype, '') != '', func.lower(func.ltrim(MediaThumb.filetype, '.'))),
+    (MediaThumb.media_filename.like('%.%'), func.lower(func.regexp_replace(MediaThumb.media_filename, r'^.*\.', ''))),
+    else_=''
+)
+MEDIA_CATEGORY = case(
+    (_mediatype.in_(IMAGE_MEDIATYPES), 'image'),
+    (_mediatype.in_(VIDEO_MEDIATYPES), 'video'),
+    (_mediatype.in_(MODEL_MEDIATYPES), '3d'),
+    (_extension.in_(VIDEO_EXTENSIONS), 'video'),
+    (_extension.in_(MODEL_EXTENSIONS), '3d'),
+    else_='image'
+)
+
+# Columns of the media responses, listed as plain rows rather than ORM objects
+MEDIA_COLUMNS = (
+    MediaThumb.id_media, MediaThumb.media_filename, MediaThumb.mediatype,
+    MediaThumb.filetype, MediaThumb.filepath, MediaThumb.path_resize
+)
+
+# Image fetches in progress, awaited by concurrent requests for the same image
+# instead of each of them hitting the storage server; keyed by cache and media id,
+# as both caches are keyed by the bare media id. The entries also keep the tasks
+# alive while no request awaits them
+pending_fetches: Dict[Tuple[SimpleTTLCache, int], asyncio.Task] = {}
+
+# Shared client for the storage server, keeping connections alive across requests;
+# closed by the app's lifespan
+storage_client = httpx.AsyncClient(
+    headers={"X-API-Key": settings.STORAGE_API_KEY} if settings.STORAGE_API_KEY else None,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128)
+)
+
+
+# URL prefixes, built once from the settings; keyed by is_thumbnail where the folder differs
+STORAGE_URL_PREFIXES = {
+    is_thumbnail: f"{settings.STORAGE_SERVER_URL.rstrip('/')}/files/{folder}/"
+    for is_thumbnail, folder in ((True, "thumbnail"), (False, "original"))
+}
+PUBLIC_PROXY_URL_PREFIXES = {
+    is_thumbnail: f"{settings.BACKEND_PUBLIC_URL.rstrip('/')}/api/media/public/{folder}/"
+    for is_thumbnail, folder in ((True, "thumbnail"), (False, "original"))
+}
+CLOUDINARY_THUMBNAIL_TRANSFORMATIONS = "f_auto,q_auto,w_150,h_150,c_fill"
+CLOUDINARY_FULL_TRANSFORMATIONS = "f_auto,q_auto:good,w_1200,c_limit"
+CLOUDINARY_UPLOAD_THUMBNAIL_PREFIX = (
+    f"https://res.cloudinary.com/{settings.CLOUDINARY_CLOUD_NAME}/image/upload/"
+    f"{CLOUDINARY_THUMBNAIL_TRANSFORMATIONS}/pyarchinit/thumbnails/thumb/"
+)
+# Fetch URLs embed the URL-encoded proxy URL; encoding is per character, so the
+# encoded proxy prefix is computed here and only the file path is encoded per call
+CLOUDINARY_FETCH_URL_PREFIXES = {
+    is_thumbnail: (
+        f"https://res.cloudinary.com/{settings.CLOUDINARY_CLOUD_NAME}/image/fetch/{transformations}/"
+        f"{quote(PUBLIC_PROXY_URL_PREFIXES[is_thumbnail], safe='')}"
+    )
+    for is_thumbnail, transformations in (
+        (True, CLOUDINARY_THUMBNAIL_TRANSFORMATIONS), (False, CLOUDINARY_FULL_TRANSFORMATIONS)
+    )
+}
 
 
 def get_storage_url(filepath: str, is_thumbnail: bool = True) -> str:
@@ -84,14 +120,7 @@ def get_storage_url(filepath: str, is_thumbnail: bool = True) -> str:
     if not filepath:
         return None
 
-    base_url = settings.STORAGE_SERVER_URL.rstrip('/')
-    folder = "thumbnail" if is_thumbnail else "original"
-
-    # If filepath already contains the folder, use it as is
-    if filepath.startswith('/'):
-        filepath = filepath[1:]
-
-    return f"{base_url}/files/{folder}/{filepath}"
+    return STORAGE_URL_PREFIXES[is_thumbnail] + filepath.removeprefix('/')
 
 
 def get_public_proxy_url(filepath: str, is_thumbnail: bool = True) -> str:
@@ -99,13 +128,7 @@ def get_public_proxy_url(filepath: str, is_thumbnail: bool = True) -> str:
     if not filepath:
         return None
 
-    base_url = settings.BACKEND_PUBLIC_URL.rstrip('/')
-    folder = "thumbnail" if is_thumbnail else "original"
-
-    if filepath.startswith('/'):
-        filepath = filepath[1:]
-
-    return f"{base_url}/api/media/public/{folder}/{filepath}"
+    return PUBLIC_PROXY_URL_PREFIXES[is_thumbnail] + filepath.removeprefix('/')
 
 
 def get_direct_cloudinary_url(id_media: int, media_filename: str, is_thumbnail: bool = True) -> str:
@@ -113,17 +136,12 @@ def get_direct_cloudinary_url(id_media: int, media_filename: str, is_thumbnail:
     Generate direct Cloudinary URL for uploaded media.
     After migration, thumbnails are stored directly in Cloudinary.
     """
-    cloud_name = settings.CLOUDINARY_CLOUD_NAME
-
-    if is_thumbnail:
-        # Direct URL to uploaded thumbnail with optimizations
-        transformations = "f_auto,q_auto,w_150,h_150,c_fill"
-        public_id = f"pyarchinit/thumbnails/thumb/{id_media}_{media_filename}"
-    else:
+    if not is_thumbnail:
         # For originals, we still use fetch URL through proxy (they're on storage server)
         return None
 
-    return f"https://res.cloudinary.com/{cloud_name}/image/upload/{transformations}/{public_id}"
+    # Direct URL to uploaded thumbnail with optimizations
+    return f"{CLOUDINARY_UPLOAD_THUMBNAIL_PREFIX}{id_media}_{media_filename}"
 
 
 def get_cloudinary_fetch_url(filepath: str, is_thumbnail: bool = True) -> str:
@@ -131,23 +149,8 @@ def get_cloudinary_fetch_url(filepath: str, is_thumbnail: bool = True) -> str:
     if not filepath:
         return None
 
-    cloud_name = settings.CLOUDINARY_CLOUD_NAME
-
-    if is_thumbnail:
-        # Thumbnail: small size, auto format, auto quality
-        transformations = "f_auto,q_auto,w_150,h_150,c_fill"
-    else:
-        # Full image: larger size, good quality, auto format
-        transformations = "f_auto,q_auto:good,w_1200,c_limit"
-
-    # Get URL through our public proxy (which has storage server auth)
-    proxy_url = get_public_proxy_url(filepath, is_thumbnail)
-
-    # URL encode the proxy URL
-    import urllib.parse
-    encoded_url = urllib.parse.quote(proxy_url, safe='')
-
-    return f"https://res.cloudinary.com/{cloud_name}/image/fetch/{transformations}/{encoded_url}"
+    # Fetched through our public proxy (which has storage server auth), URL encoded
+    return CLOUDINARY_FETCH_URL_PREFIXES[is_thumbnail] + quote(filepath.removeprefix('/'), safe='')
 
 
 def get_media_url(filepath: str, is_thumbnail: bool = True, media_cat: str = "image",
@@ -173,40 +176,125 @@ def get_media_url(filepath: str, is_thumbnail: bool = True, media_cat: str = "im
     return get_public_proxy_url(filepath, is_thumbnail)
 
 
+def media_response(thumb, media_cat: str) -> MediaResponse:
+    """MediaResponse of a thumbnail record or MEDIA_COLUMNS row, with both URLs built on the same serving route
+
+    Built without validation, the values come straight from typed columns
+    """
+    full_path = thumb.path_resize or thumb.filepath
+    if settings.CLOUDINARY_ENABLED and media_cat == "image":
+        if thumb.filepath and thumb.id_media and thumb.media_filename:
+            thumbnail_url = get_direct_cloudinary_url(thumb.id_media, thumb.media_filename, is_thumbnail=True)
+        else:
+            thumbnail_url = get_cloudinary_fetch_url(thumb.filepath, is_thumbnail=True)
+        full_url = get_cloudinary_fetch_url(full_path, is_thumbnail=False)
+    else:
+        thumbnail_url = get_public_proxy_url(thumb.filepath, is_thumbnail=True)
+        full_url = get_public_proxy_url(full_path, is_thumbnail=False)
+
+    return MediaResponse.model_construct(
+        id_media=thumb.id_media,
+        media_filename=thumb.media_filename,
+        mediatype=thumb.mediatype,
+        filetype=thumb.filetype,
+        media_category=media_cat,
+        filepath=thumb.filepath,
+        path_resize=thumb.path_resize,
+        thumbnail_url=thumbnail_url,
+        full_url=full_url
+    )
+
+
 async def fetch_and_cache_image(
     url: str,
     cache: SimpleTTLCache,
-    cache_key: str
-) -> Tuple[bytes, str]:
-    """Fetch image from storage server and cache it"""
-    # Check cache first
-    async with cache_lock:
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached
-
-    # Fetch from storage server
-    async with httpx.AsyncClient() as client:
-        headers = {}
-        if settings.STORAGE_API_KEY:
-            headers["X-API-Key"] = settings.STORAGE_API_KEY
-
-        response = await client.get(url, headers=headers, timeout=60.0)
+    cache_key: int,
+    response: Optional[httpx.Response] = None
+) -> Tuple[Tuple[bytes, str, str], bool]:
+    """Fetch image from storage server and cache it, with its content type and ETag
+
+    Returns the image and whether it was served from the cache. An already opened
+    response for the image is read instead of fetching it again, or closed if the
+    image turns out to be cached or being fetched. Cache operations never await,
+    so reads need no lock; concurrent misses on the same key share a single fetch,
+    run as a task of its own so that a client disconnecting cancels only its wait
+    """
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if response is not None:
+            await response.aclose()
+        return cached, True
+
+    fetch = pending_fetches.get((cache, cache_key))
+    if fetch is None:
+        fetch = asyncio.create_task(fetch_into_cache(url, cache, cache_key, response))
+        # Its error is retrieved here, whether or not a request still awaits it
+        fetch.add_done_callback(lambda task: task.cancelled() or task.exception())
+        pending_fetches[cache, cache_key] = fetch
+    elif response is not None:
+        await response.aclose()
+    return await asyncio.shield(fetch), False
+
+
+async def fetch_into_cache(
+    url: str,
+    cache: SimpleTTLCache,
+    cache_key: int,
+    response: Optional[httpx.Response] = None
+) -> Tuple[bytes, str, str]:
+    """The shared fetch of fetch_and_cache_image, listed in pending_fetches until it is done"""
+    try:
+        image_data = await (read_image(response) if response is not None else fetch_image(url))
+        cache.set(cache_key, image_data)
+        return image_data
+    finally:
+        del pending_fetches[cache, cache_key]
 
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Failed to fetch image: {response.status_code}"
-            )
 
-        content_type = response.headers.get("content-type", "image/jpeg")
-        image_data = (response.content, content_type)
+async def fetch_image(url: str) -> Tuple[bytes, str, str]:
+    """Fetch an image from the storage server, with its content type and ETag"""
+    return await read_image(await open_image(url))
 
-        # Store in cache
-        async with cache_lock:
-            cache.set(cache_key, image_data)
 
-        return image_data
+async def open_image(url: str) -> httpx.Response:
+    """Request an image from the storage server, returning as soon as the headers are in"""
+    response = await storage_client.send(storage_client.build_request("GET", url), stream=True)
+
+    if response.status_code != 200:
+        await response.aclose()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Failed to fetch image: {response.status_code}"
+        )
+    return response
+
+
+async def read_image(response: httpx.Response) -> Tuple[bytes, str, str]:
+    """Read an opened image response whole, with its content type and ETag"""
+    try:
+        content = await response.aread()
+    finally:
+        await response.aclose()
+
+    content_type = response.headers.get("content-type", "image/jpeg")
+    # Strong validator, hashed once when the image enters the cache
+    etag = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+    return content, content_type, etag
+
+
+def image_response(request: Request, image: Tuple[bytes, str, str], cache_hit: bool) -> Response:
+    """Send a proxied image, or 304 Not Modified when the browser already holds this version"""
+    image_data, content_type, etag = image
+    headers = {
+        "Cache-Control": "public, max-age=86400",  # 24 hours browser cache
+        "ETag": etag,
+        "X-Cache": "HIT" if cache_hit else "MISS"
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=image_data, media_type=content_type, headers=headers)
 
 
 # Public proxy endpoint for Cloudinary to fetch images (no auth required)
@@ -228,29 +316,27 @@ async def public_image_proxy(folder: str, filepath: str):
     url = f"{base_url}/files/{folder}/{filepath}"
 
     try:
-        async with httpx.AsyncClient() as client:
-            headers = {}
-            if settings.STORAGE_API_KEY:
-                headers["X-API-Key"] = settings.STORAGE_API_KEY
-
-            response = await client.get(url, headers=headers, timeout=60.0)
+        # Originals can be large: pass the body through as it arrives instead of buffering it
+        response = await storage_client.send(storage_client.build_request("GET", url), stream=True)
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Image not found or unavailable"
-                )
+        if response.status_code != 200:
+            await response.aclose()
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Image not found or unavailable"
+            )
 
-            content_type = response.headers.get("content-type", "image/jpeg")
+        content_type = response.headers.get("content-type", "image/jpeg")
 
-            return Response(
-                content=response.content,
-                media_type=content_type,
-                headers={
-                    "Cache-Control": "public, max-age=31536000",  # 1 year cache for CDN
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+        return StreamingResponse(
+            response.aiter_bytes(),
+            media_type=content_type,
+            headers={
+                "Cache-Control": "public, max-age=31536000",  # 1 year cache for CDN
+                "Access-Control-Allow-Origin": "*"
+            },
+            background=BackgroundTask(response.aclose)
+        )
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Error fetching image: {str(e)}")
 
@@ -269,7 +355,7 @@ async def get_media_categories():
 
 
 @router.get("/for-entity/{entity_type}/{entity_id}", response_model=List[MediaResponse])
-async def get_media_for_entity(
+def get_media_for_entity(
     entity_type: str,
     entity_id: int,
     category: Optional[str] = Query(None, description="Filter by media category: image, video, 3d"),
@@ -280,48 +366,46 @@ async def get_media_for_entity(
     entity_type: US, REPERTO, CERAMICA, etc.
     category: Optional filter by media_category (image, video, 3d)
     """
-    # Query media associations
-    associations = db.query(MediaToEntity).filter(
+    # The first thumbnail of each media associated with the entity, in one query
+    # (DISTINCT ON, as a media can have several thumbnail rows)
+    thumbs = db.query(MediaThumb).join(
+        MediaToEntity, MediaToEntity.id_media == MediaThumb.id_media
+    ).filter(
         MediaToEntity.entity_type == entity_type.upper(),
         MediaToEntity.id_entity == entity_id
-    ).all()
+    ).distinct(MediaThumb.id_media).order_by(MediaThumb.id_media, MediaThumb.id_media_thumb).all()
 
     media_list = []
-    for assoc in associations:
-        # Get thumbnail info
-        thumb = db.query(MediaThumb).filter(
-            MediaThumb.id_media == assoc.id_media
-        ).first()
-
-        if thumb:
-            media_cat = get_media_category(thumb.media_filename, thumb.filetype, thumb.mediatype)
-
-            # Filter by category if specified
-            if category and category != "all" and media_cat != category:
-                continue
-
-            media_list.append(MediaResponse(
-                id_media=thumb.id_media,
-                media_filename=thumb.media_filename,
-                mediatype=thumb.mediatype,
-                filetype=thumb.filetype,
-                media_category=media_cat,
-                filepath=thumb.filepath,
-                path_resize=thumb.path_resize,
-                thumbnail_url=get_media_url(thumb.filepath, is_thumbnail=True, media_cat=media_cat,
-                                            id_media=thumb.id_media, media_filename=thumb.media_filename),
-                full_url=get_media_url(thumb.path_resize or thumb.filepath, is_thumbnail=False, media_cat=media_cat)
-            ))
+    for thumb in thumbs:
+        media_cat = get_media_category(thumb.media_filename, thumb.filetype, thumb.mediatype)
+
+        # Filter by category if specified
+        if category and category != "all" and media_cat != category:
+            continue
+
+        media_list.append(media_response(thumb, media_cat))
 
     return media_list
 
 
-@router.get("/thumbnail/{media_id}")
-async def get_thumbnail(media_id: int, db: Session = Depends(get_db)):
-    """Get thumbnail - redirects to Cloudinary if enabled, otherwise proxies"""
-    from fastapi.responses import RedirectResponse
+def find_media(media_id: int):
+    """Columns of a media's thumbnail row, None if there is none
 
-    thumb = db.query(MediaThumb).filter(MediaThumb.id_media == media_id).first()
+    Called through run_in_threadpool by the image proxies, which are async for their
+    fetches, so that the query runs on a session of its own, off the event loop
+    """
+    with SessionLocal() as db:
+        return db.execute(select(*MEDIA_COLUMNS).where(MediaThumb.id_media == media_id).limit(1)).first()
+
+
+@router.get("/thumbnail/{media_id}", deprecated=True)
+async def get_thumbnail(media_id: int, request: Request):
+    """Get thumbnail - redirects to Cloudinary if enabled, otherwise proxies
+
+    Deprecated: use the thumbnail_url of the media responses, which already points
+    to the CDN or to the public proxy and saves the redirect
+    """
+    thumb = await run_in_threadpool(find_media, media_id)
     if not thumb:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -333,34 +417,24 @@ async def get_thumbnail(media_id: int, db: Session = Depends(get_db)):
 
     # If Cloudinary is enabled, redirect directly to Cloudinary URL
     if settings.CLOUDINARY_ENABLED:
-        return RedirectResponse(url=url, status_code=302)
+        return RedirectResponse(url=url, status_code=302, headers={"Link": f'<{url}>; rel="canonical"'})
 
     # Otherwise, proxy through backend with caching
-    cache_key = f"thumb_{media_id}"
-
     try:
-        image_data, content_type = await fetch_and_cache_image(
-            url, thumbnail_cache, cache_key
-        )
-
-        return Response(
-            content=image_data,
-            media_type=content_type,
-            headers={
-                "Cache-Control": "public, max-age=86400",  # 24 hours browser cache
-                "X-Cache": "HIT" if cache_key in thumbnail_cache else "MISS"
-            }
-        )
+        image, cache_hit = await fetch_and_cache_image(url, thumbnail_cache, media_id)
+        return image_response(request, image, cache_hit)
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Error fetching thumbnail: {str(e)}")
 
 
-@router.get("/full/{media_id}")
-async def get_full_image(media_id: int, db: Session = Depends(get_db)):
-    """Get full image - redirects to Cloudinary if enabled, otherwise proxies"""
-    from fastapi.responses import RedirectResponse
+@router.get("/full/{media_id}", deprecated=True)
+async def get_full_image(media_id: int, request: Request):
+    """Get full image - redirects to Cloudinary if enabled, otherwise proxies
 
-    thumb = db.query(MediaThumb).filter(MediaThumb.id_media == media_id).first()
+    Deprecated: use the full_url of the media responses, which already points
+    to the CDN or to the public proxy and saves the redirect
+    """
+    thumb = await run_in_threadpool(find_media, media_id)
     if not thumb:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -372,24 +446,30 @@ async def get_full_image(media_id: int, db: Session = Depends(get_db)):
 
     # If Cloudinary is enabled, redirect directly to Cloudinary URL
     if settings.CLOUDINARY_ENABLED:
-        return RedirectResponse(url=url, status_code=302)
+        return RedirectResponse(url=url, status_code=302, headers={"Link": f'<{url}>; rel="canonical"'})
 
     # Otherwise, proxy through backend with caching
-    cache_key = f"full_{media_id}"
+
+    cached = full_image_cache.get(media_id)
+    if cached is not None:
+        return image_response(request, cached, True)
 
     try:
-        image_data, content_type = await fetch_and_cache_image(
-            url, full_image_cache, cache_key
-        )
+        # Unless another request is already fetching it, look at the size before buffering the image
+        response = None
+        if (full_image_cache, media_id) not in pending_fetches:
+            response = await open_image(url)
+            length = response.headers.get("content-length")
+            if length is None or int(length) > FULL_IMAGE_MAX_BUFFERED:
+                return StreamingResponse(
+                    response.aiter_bytes(IMAGE_CHUNK_SIZE),
+                    media_type=response.headers.get("content-type", "image/jpeg"),
+                    headers={"Cache-Control": "public, max-age=86400", "X-Cache": "MISS"},
+                    background=BackgroundTask(response.aclose)
+                )
 
-        return Response(
-            content=image_data,
-            media_type=content_type,
-            headers={
-                "Cache-Control": "public, max-age=86400",  # 24 hours browser cache
-                "X-Cache": "HIT" if cache_key in full_image_cache else "MISS"
-            }
-        )
+        image, cache_hit = await fetch_and_cache_image(url, full_image_cache, media_id, response)
+        return image_response(request, image, cache_hit)
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Error fetching image: {str(e)}")
 
@@ -402,59 +482,55 @@ async def get_cache_stats():
             "enabled": settings.CLOUDINARY_ENABLED,
             "cloud_name": settings.CLOUDINARY_CLOUD_NAME if settings.CLOUDINARY_ENABLED else None
         },
-        "thumbnail_cache": {
-            "size": len(thumbnail_cache),
-            "maxsize": thumbnail_cache.maxsize,
-            "ttl": thumbnail_cache.ttl
-        },
-        "full_image_cache": {
-            "size": len(full_image_cache),
-            "maxsize": full_image_cache.maxsize,
-            "ttl": full_image_cache.ttl
-        }
+        "thumbnail_cache": cache_stats(thumbnail_cache),
+        "full_image_cache": cache_stats(full_image_cache)
+    }
+
+
+def cache_stats(cache: Optional[SimpleTTLCache]) -> Optional[dict]:
+    """Usage of an image cache, None when it is disabled"""
+    if cache is None:
+        return None
+    return {
+        "size": len(cache),
+        "maxsize": cache.maxsize,
+        "bytes": cache.nbytes,
+        "maxbytes": cache.maxbytes,
+        "ttl": cache.ttl
     }
 
 
 @router.delete("/cache/clear")
 async def clear_cache():
     """Clear all image caches"""
-    async with cache_lock:
-        thumbnail_cache.clear()
-        full_image_cache.clear()
+    for cache in (thumbnail_cache, full_image_cache):
+        if cache is not None:
+            cache.clear()
     return {"message": "Cache cleared"}
 
 
 @router.get("/list")
-async def list_media(
+def list_media(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
     mediatype: Optional[str] = None,
+    include_total: bool = Query(True, description="Count all the matching media; the total is null when false"),
     db: Session = Depends(get_db)
 ):
     """List all media files"""
-    query = db.query(MediaThumb)
+    query = db.query(*MEDIA_COLUMNS)
 
     if mediatype:
         query = query.filter(MediaThumb.mediatype == mediatype)
 
-    total = query.count()
+    # The count scans every matching row, clients paging through the list can skip it
+    total = query.count() if include_total else None
     items = query.offset(skip).limit(limit).all()
 
     media_items = []
     for m in items:
         media_cat = get_media_category(m.media_filename, m.filetype, m.mediatype)
-        media_items.append(MediaResponse(
-            id_media=m.id_media,
-            media_filename=m.media_filename,
-            mediatype=m.mediatype,
-            filetype=m.filetype,
-            media_category=media_cat,
-            filepath=m.filepath,
-            path_resize=m.path_resize,
-            thumbnail_url=get_media_url(m.filepath, is_thumbnail=True, media_cat=media_cat,
-                                        id_media=m.id_media, media_filename=m.media_filename),
-            full_url=get_media_url(m.path_resize or m.filepath, is_thumbnail=False, media_cat=media_cat)
-        ))
+        media_items.append(media_response(m, media_cat))
 
     return {
         "total": total,
@@ -463,7 +539,7 @@ async def list_media(
 
 
 @router.get("/search")
-async def search_media_with_associations(
+def search_media_with_associations(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
     media_category: Optional[str] = Query(None, description="Filter by category: image, video, 3d"),
@@ -475,69 +551,52 @@ async def search_media_with_associations(
     Search media files with their entity associations.
     Returns ONLY media that have at least one association.
     """
-    # First get total statistics from media WITH associations only
-    all_media_query = db.query(MediaThumb).join(
-        MediaToEntity, MediaThumb.id_media == MediaToEntity.id_media
-    ).distinct()
+    # Only media with at least one association (of the given entity type)
+    associated = exists().where(MediaToEntity.id_media == MediaThumb.id_media)
+    if entity_type:
+        associated = associated.where(MediaToEntity.entity_type == entity_type.upper())
+    conditions = [associated]
 
     # Apply filename filter if provided
     if filename:
-        all_media_query = all_media_query.filter(MediaThumb.media_filename.ilike(f"%{filename}%"))
+        conditions.append(MediaThumb.media_filename.ilike(f"%{filename}%"))
 
-    # Filter by entity_type if provided
-    if entity_type:
-        all_media_query = all_media_query.filter(MediaToEntity.entity_type == entity_type.upper())
-
-    # Count by mediatype for statistics
-    all_media = all_media_query.all()
-
-    # Calculate statistics from all matching media
+    # Statistics by category over all the matching media, counted by the database
     stats = {"image": 0, "video": 0, "3d": 0}
-    for m in all_media:
-        cat = get_media_category(m.media_filename, m.filetype, m.mediatype)
-        if cat in stats:
-            stats[cat] += 1
+    counts = db.query(MEDIA_CATEGORY, func.count(MediaThumb.id_media_thumb)).filter(
+        *conditions
+    ).group_by(MEDIA_CATEGORY)
+    for cat, count in counts:
+        stats[cat] = count
 
     # Filter total count by media_category if specified
-    total_count = len(all_media)
-    if media_category:
-        total_count = stats.get(media_category, 0)
-
-    # Now get paginated results - only media with associations
-    query = db.query(MediaThumb).join(
-        MediaToEntity, MediaThumb.id_media == MediaToEntity.id_media
-    ).distinct()
-
-    if filename:
-        query = query.filter(MediaThumb.media_filename.ilike(f"%{filename}%"))
-
-    if entity_type:
-        query = query.filter(MediaToEntity.entity_type == entity_type.upper())
-
-    # Get paginated results
-    thumbs = query.offset(skip).limit(limit).all()
-
-    # Process results
-    media_list = []
-    for thumb in thumbs:
-        media_cat = get_media_category(thumb.media_filename, thumb.filetype, thumb.mediatype)
+    total_count = stats.get(media_category, 0) if media_category else sum(stats.values())
 
-        # Filter by category if specified
-        if media_category and media_category != media_cat:
-            continue
+    # Paginated results, filtered by category before the limit so pages are full
+    query = db.query(*MEDIA_COLUMNS).filter(*conditions)
+    if media_category:
+        query = query.filter(MEDIA_CATEGORY == media_category)
+    thumbs = query.order_by(MediaThumb.id_media_thumb).offset(skip).limit(limit).all()
 
-        # Get all associations for this media
-        associations = db.query(MediaToEntity).filter(
-            MediaToEntity.id_media == thumb.id_media
-        ).all()
+    page = [(thumb, get_media_category(thumb.media_filename, thumb.filetype, thumb.mediatype)) for thumb in thumbs]
 
-        entity_info = []
+    # All associations of the page's media, in one query
+    entities = defaultdict(list)
+    if page:
+        associations = db.query(MediaToEntity.id_media, MediaToEntity.entity_type, MediaToEntity.id_entity).filter(
+            MediaToEntity.id_media.in_([thumb.id_media for thumb, _ in page])
+        )
         for a in associations:
-            entity_info.append({
+            entities[a.id_media].append({
                 "entity_type": a.entity_type,
                 "id_entity": a.id_entity
             })
 
+    # Process results
+    media_list = []
+    for thumb, media_cat in page:
+        entity_info = entities[thumb.id_media]
+
         media_list.append({
             "id_media": thumb.id_media,
             "media_filename": thumb.media_filename,
@@ -565,45 +624,34 @@ async def search_media_with_associations(
 
 
 @router.get("/statistics")
-async def get_media_statistics(db: Session = Depends(get_db)):
+def get_media_statistics(db: Session = Depends(get_db)):
     """Get media statistics"""
-    total = db.query(func.count(MediaThumb.id_media_thumb)).scalar()
-
-    by_type = db.query(
-        MediaThumb.mediatype,
+    # Counts by media type and by associated entity type, in one round trip
+    by_type = select(
+        literal('type').label('kind'),
+        MediaThumb.mediatype.label('name'),
         func.count(MediaThumb.id_media_thumb).label('count')
-    ).group_by(MediaThumb.mediatype).all()
-
-    # Count associations by entity type
-    by_entity = db.query(
-        MediaToEntity.entity_type,
+    ).group_by(MediaThumb.mediatype)
+    by_entity = select(
+        literal('entity').label('kind'),
+        MediaToEntity.entity_type.label('name'),
         func.count(MediaToEntity.id_mediaToEntity).label('count')
-    ).group_by(MediaToEntity.entity_type).all()
+    ).group_by(MediaToEntity.entity_type)
+    rows = db.execute(union_all(by_type, by_entity)).all()
 
     return {
-        "total_media": total,
-        "by_type": {t[0] or "unknown": t[1] for t in by_type},
-        "by_entity_type": {e[0] or "unknown": e[1] for e in by_entity}
+        "total_media": sum(r.count for r in rows if r.kind == 'type'),
+        "by_type": {r.name or "unknown": r.count for r in rows if r.kind == 'type'},
+        "by_entity_type": {r.name or "unknown": r.count for r in rows if r.kind == 'entity'}
     }
 
 
 @router.get("/{media_id}", response_model=MediaResponse)
-async def get_media_info(media_id: int, db: Session = Depends(get_db)):
+def get_media_info(media_id: int, db: Session = Depends(get_db)):
     """Get media info by ID"""
     thumb = db.query(MediaThumb).filter(MediaThumb.id_media == media_id).first()
     if not thumb:
         raise HTTPException(status_code=404, detail="Media not found")
 
     media_cat = get_media_category(thumb.media_filename, thumb.filetype, thumb.mediatype)
-    return MediaResponse(
-        id_media=thumb.id_media,
-        media_filename=thumb.media_filename,
-        mediatype=thumb.mediatype,
-        filetype=thumb.filetype,
-        media_category=media_cat,
-        filepath=thumb.filepath,
-        path_resize=thumb.path_resize,
-        thumbnail_url=get_media_url(thumb.filepath, is_thumbnail=True, media_cat=media_cat,
-                                    id_media=thumb.id_media, media_filename=thumb.media_filename),
-        full_url=get_media_url(thumb.path_resize or thumb.filepath, is_thumbnail=False, media_cat=media_cat)
-    )
+    return media_response(thumb, media_cat)
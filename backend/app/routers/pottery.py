@@ -2,19 +2,50 @@
 API routes for Pottery
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 from typing import List, Optional
+import orjson
 
-from ..database import get_db
+from ..database import SessionLocal, get_db
+from ..cache import SimpleTTLCache
+from ..pagination import sort_keys, encode_cursor, after_cursor
 from ..models import Pottery
-from ..schemas import PotteryResponse, PaginatedResponse
+from ..schemas import PotteryResponse, CursorPaginatedResponse, paginated_orjson
 
 router = APIRouter(prefix="/pottery", tags=["Pottery"])
 
+# Listing order; the primary key makes it total, so that it can be paged by key.
+# Sorted by its sort_keys, which ix_pottery_table_keyset indexes
+POTTERY_ORDER = (Pottery.sito, Pottery.id_number, Pottery.id_rep)
+
+# Whether an item has a drawing, i.e. a drawing field that is not blank, computed in the SELECT
+HAS_DRAWING = func.coalesce(Pottery.drawing.op('~')(r'\S'), False).label('has_drawing')
+
+# Columns the responses serialize, read as plain rows rather than ORM objects
+POTTERY_RESPONSE_COLUMNS = [
+    HAS_DRAWING if field == 'has_drawing' else getattr(Pottery, field) for field in PotteryResponse.model_fields
+]
+
+# Rows loaded per batch by the NDJSON stream
+STREAM_BATCH_SIZE = 1000
+
+# Totals of the paginated listing, counted once for all the pages of a filter
+count_cache = SimpleTTLCache(maxsize=100, ttl=60)  # 1 min
+
+# Statistics by site; records are edited from the desktop client, so the TTL
+# bounds how stale they get
+stats_cache = SimpleTTLCache(maxsize=100, ttl=300)  # 5 min
+
+# Distinct forms, materials, fabrics and wares by site, for the filter dropdowns, expiring with the TTL
+LOOKUP_COLUMNS = (Pottery.form, Pottery.material, Pottery.fabric, Pottery.ware)
+lookups_cache = SimpleTTLCache(maxsize=100, ttl=300)  # 5 min
+
 
 def add_drawing_info(pottery_list: List) -> List[dict]:
-    """Add has_drawing field to pottery list"""
+    """Convert pottery rows, with their has_drawing column, to dicts"""
     if not pottery_list:
         return []
 
@@ -53,26 +84,24 @@ def add_drawing_info(pottery_list: List) -> List[dict]:
             "specific_shape": p.specific_shape,
             "bag": p.bag,
             "sector": p.sector,
-            "has_drawing": bool(p.drawing and p.drawing.strip())  # True if drawing is not empty
+            "has_drawing": p.has_drawing
         }
         result.append(p_dict)
     return result
 
 
-@router.get("/", response_model=List[PotteryResponse])
-async def get_pottery_list(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=1000),
-    sito: Optional[str] = None,
-    area: Optional[str] = None,
-    us: Optional[str] = None,
-    form: Optional[str] = None,
-    material: Optional[str] = None,
-    search: Optional[str] = None,
-    db: Session = Depends(get_db)
+def pottery_query(
+    db: Session,
+    sito: Optional[str],
+    area: Optional[str],
+    us: Optional[str],
+    form: Optional[str],
+    material: Optional[str],
+    search: Optional[str],
+    ware: Optional[str] = None
 ):
-    """Get list of pottery items"""
-    query = db.query(Pottery)
+    """Pottery matching the listing filters, shared by the list, the stream and the paginated listing"""
+    query = db.query(*POTTERY_RESPONSE_COLUMNS)
 
     if sito:
         query = query.filter(Pottery.sito == sito)
@@ -84,6 +113,8 @@ async def get_pottery_list(
         query = query.filter(Pottery.form == form)
     if material:
         query = query.filter(Pottery.material == material)
+    if ware:
+        query = query.filter(Pottery.ware.ilike(f"%{ware}%"))
     if search:
         query = query.filter(
             (Pottery.note.ilike(f"%{search}%")) |
@@ -91,16 +122,65 @@ async def get_pottery_list(
             (Pottery.specific_form.ilike(f"%{search}%"))
         )
 
+    return query
+
+
+@router.get("/", response_model=List[PotteryResponse])
+def get_pottery_list(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    us: Optional[str] = None,
+    form: Optional[str] = None,
+    material: Optional[str] = None,
+    search: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get list of pottery items"""
+    query = pottery_query(db, sito, area, us, form, material, search)
+
     pottery = query.order_by(
         Pottery.sito,
         Pottery.id_number
     ).offset(skip).limit(limit).all()
 
-    return add_drawing_info(pottery)
+    # The dicts already have PotteryResponse's fields and types, so they skip the response model's validation
+    return ORJSONResponse(add_drawing_info(pottery))
 
 
-@router.get("/paginated", response_model=PaginatedResponse)
-async def get_pottery_paginated(
+def iter_ndjson(query):
+    """Serialize a query's pottery one JSON line at a time, loading it in batches"""
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield orjson.dumps(add_drawing_info([row])[0]) + b"\n"
+
+
+@router.get("/stream")
+def stream_pottery(
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    us: Optional[str] = None,
+    form: Optional[str] = None,
+    material: Optional[str] = None,
+    search: Optional[str] = None
+):
+    """Stream all the matching pottery as NDJSON, one PotteryResponse per line
+
+    The body is sent after the handler returns, so the rows are read on a session
+    of its own, closed once the response is done
+    """
+    db = SessionLocal()
+    query = pottery_query(db, sito, area, us, form, material, search)
+
+    return StreamingResponse(
+        iter_ndjson(query.order_by(*sort_keys(POTTERY_ORDER))),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(db.close)
+    )
+
+
+@router.get("/paginated", response_model=CursorPaginatedResponse[PotteryResponse])
+def get_pottery_paginated(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     sito: Optional[str] = None,
@@ -110,179 +190,169 @@ async def get_pottery_paginated(
     material: Optional[str] = None,
     ware: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page, to page by key instead of offset"),
     db: Session = Depends(get_db)
 ):
-    """Get paginated list of pottery"""
-    query = db.query(Pottery)
+    """Get paginated list of pottery
+
+    Pages can be fetched by number, or by passing the previous page's next_cursor,
+    which reads only page_size rows however deep the page is
+    """
+    query = pottery_query(db, sito, area, us, form, material, search, ware=ware)
+
+    count_key = f"{sito}|{area}|{us}|{form}|{material}|{ware}|{search}"
+    total = count_cache.get(count_key)
+    counted = total is not None
+
+    page_query = query.order_by(*sort_keys(POTTERY_ORDER))
+    if cursor:
+        items = page_query.filter(after_cursor(cursor, POTTERY_ORDER)).limit(page_size).all()
+    elif not counted:
+        # The page and the total count in one scan, the count as a window over the filtered rows
+        items = page_query.add_columns(func.count().over().label('total')).offset(
+            (page - 1) * page_size
+        ).limit(page_size).all()
+        if items:
+            total = items[0].total
+        elif page == 1:
+            total = 0
+    else:
+        items = page_query.offset((page - 1) * page_size).limit(page_size).all()
+
+    if total is None:
+        # Paged by key, or past the last page: no row carries the count of the whole filter
+        total = query.count()
+    if not counted:
+        count_cache.set(count_key, total)
+
+    return paginated_orjson(
+        add_drawing_info(items), total, page, page_size,
+        next_cursor=encode_cursor(items[-1], POTTERY_ORDER) if len(items) == page_size else None
+    )
 
+
+def pottery_lookups(sito: Optional[str], db: Session) -> dict:
+    """Distinct non-empty forms, materials, fabrics and wares, read in a single scan
+    and cached by site"""
+    cache_key = sito
+    cached = lookups_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    query = db.query(*LOOKUP_COLUMNS, *[func.grouping(column) for column in LOOKUP_COLUMNS])
     if sito:
         query = query.filter(Pottery.sito == sito)
-    if area:
-        query = query.filter(Pottery.area == area)
-    if us is not None:
-        query = query.filter(Pottery.us == us)
-    if form:
-        query = query.filter(Pottery.form == form)
-    if material:
-        query = query.filter(Pottery.material == material)
-    if ware:
-        query = query.filter(Pottery.ware.ilike(f"%{ware}%"))
-    if search:
-        query = query.filter(
-            (Pottery.note.ilike(f"%{search}%")) |
-            (Pottery.form.ilike(f"%{search}%")) |
-            (Pottery.specific_form.ilike(f"%{search}%"))
-        )
+    rows = query.group_by(
+        func.grouping_sets(*[tuple_(column) for column in LOOKUP_COLUMNS])
+    ).order_by(*LOOKUP_COLUMNS).all()
+
+    # Each row is grouped by exactly one column, the one whose grouping() flag is 0
+    result = {f"{column.key}s": [] for column in LOOKUP_COLUMNS}
+    for row in rows:
+        for column, flag in zip(LOOKUP_COLUMNS, row[len(LOOKUP_COLUMNS):]):
+            value = getattr(row, column.key)
+            if not flag and value:
+                result[f"{column.key}s"].append(value)
+    lookups_cache.set(cache_key, result)
+    return result
 
-    total = query.count()
-    total_pages = (total + page_size - 1) // page_size
 
-    items = query.order_by(
-        Pottery.sito,
-        Pottery.id_number
-    ).offset((page - 1) * page_size).limit(page_size).all()
-
-    return {
-        "items": add_drawing_info(items),
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "total_pages": total_pages
-    }
+@router.get("/lookups")
+def get_pottery_lookups(
+    sito: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get the values of all the filter dropdowns (forms, materials, fabrics and wares) in one round trip"""
+    return pottery_lookups(sito, db)
 
 
 @router.get("/forms", response_model=List[str])
-async def get_pottery_forms(
+def get_pottery_forms(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of pottery forms"""
-    query = db.query(Pottery.form).distinct()
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    forms = query.all()
-    return [f[0] for f in forms if f[0]]
+    return pottery_lookups(sito, db)["forms"]
 
 
 @router.get("/materials", response_model=List[str])
-async def get_pottery_materials(
+def get_pottery_materials(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of pottery materials"""
-    query = db.query(Pottery.material).distinct()
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    materials = query.all()
-    return [m[0] for m in materials if m[0]]
+    return pottery_lookups(sito, db)["materials"]
 
 
 @router.get("/fabrics", response_model=List[str])
-async def get_pottery_fabrics(
+def get_pottery_fabrics(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of ceramic fabrics"""
-    query = db.query(Pottery.fabric).distinct()
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    fabrics = query.all()
-    return [f[0] for f in fabrics if f[0]]
+    return pottery_lookups(sito, db)["fabrics"]
 
 
 @router.get("/wares", response_model=List[str])
-async def get_pottery_wares(
+def get_pottery_wares(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get list of pottery wares"""
-    query = db.query(Pottery.ware).distinct()
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-    wares = query.all()
-    return [w[0] for w in wares if w[0]]
+    return pottery_lookups(sito, db)["wares"]
 
 
 @router.get("/statistics")
-async def get_pottery_statistics(
+def get_pottery_statistics(
     sito: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get statistics about pottery"""
-    query = db.query(Pottery)
-    if sito:
-        query = query.filter(Pottery.sito == sito)
-
-    total = query.count()
-
-    # Total quantity
-    total_qty = db.query(func.sum(Pottery.qty))
-    if sito:
-        total_qty = total_qty.filter(Pottery.sito == sito)
-    total_qty = total_qty.scalar() or 0
-
-    # Count by form
-    by_form = db.query(
-        Pottery.form,
-        func.count(Pottery.id_rep).label('count')
+    cache_key = sito
+    cached = stats_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Totals and counts by form, material, fabric and ware in a single scan and round trip
+    groups = (Pottery.form, Pottery.material, Pottery.fabric, Pottery.ware)
+    query = db.query(
+        *groups,
+        *[func.grouping(column) for column in groups],
+        func.count(Pottery.id_rep).label('count'),
+        func.sum(Pottery.qty).label('qty'),
+        func.count(Pottery.id_rep).filter(Pottery.drawing.isnot(None), Pottery.drawing != '').label('with_drawing')
     )
     if sito:
-        by_form = by_form.filter(Pottery.sito == sito)
-    by_form = by_form.group_by(Pottery.form).all()
-
-    # Count by material
-    by_material = db.query(
-        Pottery.material,
-        func.count(Pottery.id_rep).label('count')
-    )
-    if sito:
-        by_material = by_material.filter(Pottery.sito == sito)
-    by_material = by_material.group_by(Pottery.material).all()
-
-    # Count by fabric
-    by_fabric = db.query(
-        Pottery.fabric,
-        func.count(Pottery.id_rep).label('count')
-    )
-    if sito:
-        by_fabric = by_fabric.filter(Pottery.sito == sito)
-    by_fabric = by_fabric.group_by(Pottery.fabric).all()
-
-    # Count by ware
-    by_ware = db.query(
-        Pottery.ware,
-        func.count(Pottery.id_rep).label('count')
-    )
-    if sito:
-        by_ware = by_ware.filter(Pottery.sito == sito)
-    by_ware = by_ware.group_by(Pottery.ware).all()
-
-    # Count with drawing
-    with_drawing = db.query(func.count(Pottery.id_rep)).filter(
-        Pottery.drawing.isnot(None),
-        Pottery.drawing != ''
-    )
-    if sito:
-        with_drawing = with_drawing.filter(Pottery.sito == sito)
-    with_drawing = with_drawing.scalar() or 0
-
-    return {
-        "total": total,
-        "total_qty": total_qty,
-        "with_drawing": with_drawing,
-        "without_drawing": total - with_drawing,
-        "by_form": {f[0] or "N/A": f[1] for f in by_form},
-        "by_material": {m[0] or "N/A": m[1] for m in by_material},
-        "by_fabric": {f[0] or "N/A": f[1] for f in by_fabric},
-        "by_ware": {w[0] or "N/A": w[1] for w in by_ware}
+        query = query.filter(Pottery.sito == sito)
+    rows = query.group_by(func.grouping_sets(*[tuple_(column) for column in groups], tuple_())).all()
+
+    # Each row is grouped by at most one column, the one whose grouping() flag is 0
+    counts = {column.key: {} for column in groups}
+    for row in rows:
+        grouped = [column.key for column, flag in zip(groups, row[len(groups):2 * len(groups)]) if not flag]
+        if grouped:
+            counts[grouped[0]][getattr(row, grouped[0]) or "N/A"] = row.count
+        else:
+            totals = row
+
+    result = {
+        "total": totals.count,
+        "total_qty": totals.qty or 0,
+        "with_drawing": totals.with_drawing,
+        "without_drawing": totals.count - totals.with_drawing,
+        "by_form": counts['form'],
+        "by_material": counts['material'],
+        "by_fabric": counts['fabric'],
+        "by_ware": counts['ware']
     }
+    stats_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/{pottery_id}", response_model=PotteryResponse)
-async def get_pottery(pottery_id: int, db: Session = Depends(get_db)):
+def get_pottery(pottery_id: int, db: Session = Depends(get_db)):
     """Get a specific pottery item by ID"""
-    pottery = db.query(Pottery).filter(Pottery.id_rep == pottery_id).first()
+    pottery = db.query(*POTTERY_RESPONSE_COLUMNS).filter(Pottery.id_rep == pottery_id).first()
     if not pottery:
         raise HTTPException(status_code=404, detail="Pottery not found")
-    result = add_drawing_info([pottery])
-    return result[0] if result else pottery
+    return add_drawing_info([pottery])[0]
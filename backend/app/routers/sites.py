@@ -7,14 +7,26 @@ from sqlalchemy import func
 from typing import List, Optional
 
 from ..database import get_db
+from ..cache import SimpleTTLCache
 from ..models import Site
-from ..schemas import SiteResponse, PaginatedResponse
+from ..schemas import SiteResponse, CursorPaginatedResponse, paginated_orjson
+from ..pagination import sort_keys, encode_cursor, after_cursor
 
 router = APIRouter(prefix="/sites", tags=["Sites"])
 
+# Listing order of the paginated sites
+SITE_ORDER = (Site.id_sito,)
+
+# Site names for the site selectors, shown on most pages; sites are edited from
+# the desktop client, so the TTL bounds how long a new one takes to show up
+names_cache = SimpleTTLCache(maxsize=10, ttl=300)  # 5 min
+
+# Totals of the paginated listing, counted once for all the pages of a search
+count_cache = SimpleTTLCache(maxsize=100, ttl=60)  # 1 min
+
 
 @router.get("/", response_model=List[SiteResponse])
-async def get_sites(
+def get_sites(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
@@ -30,42 +42,72 @@ async def get_sites(
     return sites
 
 
-@router.get("/paginated", response_model=PaginatedResponse)
-async def get_sites_paginated(
+@router.get("/paginated", response_model=CursorPaginatedResponse[SiteResponse])
+def get_sites_paginated(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page, to page by key instead of offset"),
     db: Session = Depends(get_db)
 ):
-    """Get paginated list of sites"""
+    """Get paginated list of sites
+
+    Pages can be fetched by number, or by passing the previous page's next_cursor
+    """
     query = db.query(Site)
 
     if search:
         query = query.filter(Site.sito.ilike(f"%{search}%"))
 
-    total = query.count()
-    total_pages = (total + page_size - 1) // page_size
-
-    items = query.offset((page - 1) * page_size).limit(page_size).all()
-
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "total_pages": total_pages
-    }
+    # Ordered by primary key, so pages are stable and can be paged by key
+    count_key = f"{search}"
+    total = count_cache.get(count_key)
+    counted = total is not None
+
+    page_query = query.order_by(*sort_keys(SITE_ORDER))
+    if cursor:
+        items = page_query.filter(after_cursor(cursor, SITE_ORDER)).limit(page_size).all()
+    elif not counted:
+        # The page and the total count in one scan, the count as a window over the filtered rows
+        rows = page_query.add_columns(func.count().over().label('total')).offset(
+            (page - 1) * page_size
+        ).limit(page_size).all()
+        items = [row[0] for row in rows]
+        if rows:
+            total = rows[0].total
+        elif page == 1:
+            total = 0
+    else:
+        items = page_query.offset((page - 1) * page_size).limit(page_size).all()
+
+    if total is None:
+        # Paged by key, or past the last page: no row carries the count of the whole filter
+        total = query.count()
+    if not counted:
+        count_cache.set(count_key, total)
+
+    return paginated_orjson(
+        [SiteResponse.model_validate(site).model_dump() for site in items], total, page, page_size,
+        next_cursor=encode_cursor(items[-1], SITE_ORDER) if len(items) == page_size else None
+    )
 
 
 @router.get("/names", response_model=List[str])
-async def get_site_names(db: Session = Depends(get_db)):
+def get_site_names(db: Session = Depends(get_db)):
     """Get list of all site names"""
+    cache_key = "names"
+    cached = names_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     sites = db.query(Site.sito).distinct().all()
-    return [s[0] for s in sites if s[0]]
+    result = [s[0] for s in sites if s[0]]
+    names_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/{site_id}", response_model=SiteResponse)
-async def get_site(site_id: int, db: Session = Depends(get_db)):
+def get_site(site_id: int, db: Session = Depends(get_db)):
     """Get a specific site by ID"""
     site = db.query(Site).filter(Site.id_sito == site_id).first()
     if not site:
@@ -74,7 +116,7 @@ async def get_site(site_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/by-name/{site_name}", response_model=SiteResponse)
-async def get_site_by_name(site_name: str, db: Session = Depends(get_db)):
+def get_site_by_name(site_name: str, db: Session = Depends(get_db)):
     """Get a specific site by name"""
     site = db.query(Site).filter(Site.sito == site_name).first()
     if not site:
@@ -2,29 +2,61 @@
 API routes for Stratigraphic Units (US)
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case, exists, and_
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import func, case, exists, and_, or_, tuple_
 from typing import List, Optional
+import orjson
 
-from ..database import get_db
+from ..database import SessionLocal, get_db
+from ..cache import SimpleTTLCache
 from ..models import US, USView
-from ..schemas import USResponse, PaginatedResponse
+from ..schemas import USResponse, CursorPaginatedResponse, paginated_orjson
+from ..pagination import sort_keys, encode_cursor, after_cursor
 
 router = APIRouter(prefix="/us", tags=["Stratigraphic Units"])
 
+# Listing order; the primary key makes it total, so that it can be paged by key.
+# Sorted by its sort_keys, which ix_us_table_keyset indexes
+US_ORDER = (US.sito, US.area, US.us, US.id_us)
 
-def add_geometry_info(us_list: List, db: Session) -> List[dict]:
-    """Add has_geometry field to US list by checking the view"""
-    if not us_list:
-        return []
 
-    # Get all US IDs that have geometry from the view
-    us_with_geom = db.query(USView.id_us).filter(USView.the_geom.isnot(None)).all()
-    us_ids_with_geom = {row[0] for row in us_with_geom}
+# Columns the responses serialize, out of the ~100 of the US table; reading any
+# other column raises instead of quietly issuing a SELECT per row
+US_RESPONSE_COLUMNS = load_only(
+    *[getattr(US, field) for field in USResponse.model_fields if field != 'has_geometry'], raiseload=True
+)
 
-    # Convert to dicts with has_geometry field
+# Whether a US has GIS geometry, looked up in the view per row rather than by loading all its ids
+GEOMETRY_EXISTS = exists().where(
+    USView.id_us == US.id_us,
+    USView.the_geom.isnot(None)
+)
+HAS_GEOMETRY = GEOMETRY_EXISTS.label('has_geometry')
+
+# Rows loaded per batch by the NDJSON stream
+STREAM_BATCH_SIZE = 1000
+
+# Totals of the paginated listing, counted once for all the pages of a filter
+count_cache = SimpleTTLCache(maxsize=100, ttl=60)  # 1 min
+
+# Statistics by site; records are edited from the desktop client, so the TTL
+# bounds how stale they get
+stats_cache = SimpleTTLCache(maxsize=100, ttl=300)  # 5 min
+
+# Distinct areas and periods by site, for the filter dropdowns, expiring with the TTL
+facets_cache = SimpleTTLCache(maxsize=100, ttl=300)  # 5 min
+
+# Text columns a search matches, unless the listing narrows them
+US_SEARCH_COLUMNS = (US.descrizione, US.interpretazione, US.d_stratigrafica)
+
+
+def add_geometry_info(rows: List) -> List[dict]:
+    """Convert (US, has_geometry) rows to dicts with the has_geometry field"""
     result = []
-    for us in us_list:
+    for row in rows:
+        us = row.US
         us_dict = {
             "id_us": us.id_us,
             "sito": us.sito,
@@ -46,14 +78,37 @@ def add_geometry_info(us_list: List, db: Session) -> List[dict]:
             "settore": us.settore,
             "quota_min_abs": float(us.quota_min_abs) if us.quota_min_abs else None,
             "quota_max_abs": float(us.quota_max_abs) if us.quota_max_abs else None,
-            "has_geometry": us.id_us in us_ids_with_geom
+            "has_geometry": row.has_geometry
         }
         result.append(us_dict)
     return result
 
 
+def us_query(
+    db: Session,
+    sito: Optional[str],
+    area: Optional[str],
+    search: Optional[str],
+    periodo: Optional[str] = None,
+    search_columns=US_SEARCH_COLUMNS
+):
+    """Stratigraphic units matching the listing filters, shared by the list, the stream and the paginated listing"""
+    query = db.query(US).options(US_RESPONSE_COLUMNS)
+
+    if sito:
+        query = query.filter(US.sito == sito)
+    if area:
+        query = query.filter(US.area == area)
+    if periodo:
+        query = query.filter(US.periodo_iniziale == periodo)
+    if search:
+        query = query.filter(or_(*[column.ilike(f"%{search}%") for column in search_columns]))
+
+    return query
+
+
 @router.get("/", response_model=List[USResponse])
-async def get_us_list(
+def get_us_list(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     sito: Optional[str] = None,
@@ -62,159 +117,183 @@ async def get_us_list(
     db: Session = Depends(get_db)
 ):
     """Get list of stratigraphic units"""
-    query = db.query(US)
+    query = us_query(db, sito, area, search)
+
+    us_list = query.add_columns(HAS_GEOMETRY).order_by(US.sito, US.area, US.us).offset(skip).limit(limit).all()
+    # The dicts already have USResponse's fields and types, so they skip the response model's validation
+    return ORJSONResponse(add_geometry_info(us_list))
 
-    if sito:
-        query = query.filter(US.sito == sito)
-    if area:
-        query = query.filter(US.area == area)
-    if search:
-        query = query.filter(
-            (US.descrizione.ilike(f"%{search}%")) |
-            (US.interpretazione.ilike(f"%{search}%")) |
-            (US.d_stratigrafica.ilike(f"%{search}%"))
-        )
 
-    us_list = query.order_by(US.sito, US.area, US.us).offset(skip).limit(limit).all()
-    return add_geometry_info(us_list, db)
+def iter_ndjson(query):
+    """Serialize a query's US one JSON line at a time, loading them in batches"""
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield orjson.dumps(add_geometry_info([row])[0]) + b"\n"
 
 
-@router.get("/paginated", response_model=PaginatedResponse)
-async def get_us_paginated(
+@router.get("/stream")
+def stream_us(
+    sito: Optional[str] = None,
+    area: Optional[str] = None,
+    search: Optional[str] = None
+):
+    """Stream all the matching stratigraphic units as NDJSON, one USResponse per line
+
+    The body is sent after the handler returns, so the rows are read on a session
+    of its own, closed once the response is done
+    """
+    db = SessionLocal()
+    query = us_query(db, sito, area, search)
+
+    return StreamingResponse(
+        iter_ndjson(query.add_columns(HAS_GEOMETRY).order_by(*sort_keys(US_ORDER))),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(db.close)
+    )
+
+
+@router.get("/paginated", response_model=CursorPaginatedResponse[USResponse])
+def get_us_paginated(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     sito: Optional[str] = None,
     area: Optional[str] = None,
     periodo: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page, to page by key instead of offset"),
     db: Session = Depends(get_db)
 ):
-    """Get paginated list of stratigraphic units"""
-    query = db.query(US)
+    """Get paginated list of stratigraphic units
 
-    if sito:
-        query = query.filter(US.sito == sito)
-    if area:
-        query = query.filter(US.area == area)
-    if periodo:
-        query = query.filter(US.periodo_iniziale == periodo)
-    if search:
-        query = query.filter(
-            (US.descrizione.ilike(f"%{search}%")) |
-            (US.interpretazione.ilike(f"%{search}%"))
-        )
-
-    total = query.count()
-    total_pages = (total + page_size - 1) // page_size
-
-    items = query.order_by(US.sito, US.area, US.us).offset((page - 1) * page_size).limit(page_size).all()
-    items_with_geom = add_geometry_info(items, db)
-
-    return {
-        "items": items_with_geom,
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "total_pages": total_pages
-    }
+    Pages can be fetched by number, or by passing the previous page's next_cursor,
+    which reads only page_size rows however deep the page is
+    """
+    query = us_query(
+        db, sito, area, search, periodo=periodo, search_columns=(US.descrizione, US.interpretazione)
+    )
+
+    count_key = f"{sito}|{area}|{periodo}|{search}"
+    total = count_cache.get(count_key)
+    counted = total is not None
+
+    page_query = query.add_columns(HAS_GEOMETRY).order_by(*sort_keys(US_ORDER))
+    if cursor:
+        items = page_query.filter(after_cursor(cursor, US_ORDER)).limit(page_size).all()
+    elif not counted:
+        # The page and the total count in one scan, the count as a window over the filtered rows
+        items = page_query.add_columns(func.count().over().label('total')).offset(
+            (page - 1) * page_size
+        ).limit(page_size).all()
+        if items:
+            total = items[0].total
+        elif page == 1:
+            total = 0
+    else:
+        items = page_query.offset((page - 1) * page_size).limit(page_size).all()
+
+    if total is None:
+        # Paged by key, or past the last page: no row carries the count of the whole filter
+        total = query.count()
+    if not counted:
+        count_cache.set(count_key, total)
+
+    return paginated_orjson(
+        add_geometry_info(items), total, page, page_size,
+        next_cursor=encode_cursor(items[-1].US, US_ORDER) if len(items) == page_size else None
+    )
 
 
 @router.get("/areas", response_model=List[str])
-async def get_areas(sito: Optional[str] = None, db: Session = Depends(get_db)):
+def get_areas(sito: Optional[str] = None, db: Session = Depends(get_db)):
     """Get list of areas, optionally filtered by site"""
+    cache_key = f"areas|{sito}"
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = db.query(US.area).distinct()
     if sito:
         query = query.filter(US.sito == sito)
     areas = query.all()
-    return [a[0] for a in areas if a[0]]
+    result = [a[0] for a in areas if a[0]]
+    facets_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/periodi", response_model=List[str])
-async def get_periodi(sito: Optional[str] = None, db: Session = Depends(get_db)):
+def get_periodi(sito: Optional[str] = None, db: Session = Depends(get_db)):
     """Get list of periods"""
+    cache_key = f"periodi|{sito}"
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = db.query(US.periodo_iniziale).distinct()
     if sito:
         query = query.filter(US.sito == sito)
     periodi = query.all()
-    return [p[0] for p in periodi if p[0]]
+    result = [p[0] for p in periodi if p[0]]
+    facets_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/statistics")
-async def get_us_statistics(sito: Optional[str] = None, db: Session = Depends(get_db)):
+def get_us_statistics(sito: Optional[str] = None, db: Session = Depends(get_db)):
     """Get statistics about stratigraphic units"""
-    query = db.query(US)
-    if sito:
-        query = query.filter(US.sito == sito)
-
-    total = query.count()
-
-    # Count by area
-    by_area = db.query(
-        US.area,
-        func.count(US.id_us).label('count')
-    )
-    if sito:
-        by_area = by_area.filter(US.sito == sito)
-    by_area = by_area.group_by(US.area).all()
-
-    # Count by period
-    by_period = db.query(
-        US.periodo_iniziale,
-        func.count(US.id_us).label('count')
+    cache_key = sito
+    cached = stats_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Totals and counts by area, period and type in a single scan and round trip
+    groups = (US.area, US.periodo_iniziale, US.d_stratigrafica)
+    query = db.query(
+        *groups,
+        *[func.grouping(column) for column in groups],
+        func.count(US.id_us).label('count'),
+        func.count(US.id_us).filter(GEOMETRY_EXISTS).label('with_geometry')
     )
     if sito:
-        by_period = by_period.filter(US.sito == sito)
-    by_period = by_period.group_by(US.periodo_iniziale).all()
-
-    # Count by type
-    by_type = db.query(
-        US.d_stratigrafica,
-        func.count(US.id_us).label('count')
-    )
-    if sito:
-        by_type = by_type.filter(US.sito == sito)
-    by_type = by_type.group_by(US.d_stratigrafica).all()
-
-    # Count US with geometry - only count distinct id_us from the view that exist in our filtered US list
-    us_ids_query = db.query(US.id_us)
-    if sito:
-        us_ids_query = us_ids_query.filter(US.sito == sito)
-    us_ids = [u[0] for u in us_ids_query.all()]
-
-    with_geometry = db.query(func.count(func.distinct(USView.id_us))).filter(
-        USView.the_geom.isnot(None),
-        USView.id_us.in_(us_ids)
-    ).scalar() or 0 if us_ids else 0
-
-    return {
-        "total": total,
-        "with_geometry": with_geometry,
-        "without_geometry": total - with_geometry,
-        "by_area": {a[0] or "N/A": a[1] for a in by_area},
-        "by_period": {p[0] or "N/A": p[1] for p in by_period},
-        "by_type": {t[0] or "N/A": t[1] for t in by_type}
+        query = query.filter(US.sito == sito)
+    rows = query.group_by(func.grouping_sets(*[tuple_(column) for column in groups], tuple_())).all()
+
+    # Each row is grouped by at most one column, the one whose grouping() flag is 0
+    counts = {column.key: {} for column in groups}
+    for row in rows:
+        grouped = [column.key for column, flag in zip(groups, row[len(groups):2 * len(groups)]) if not flag]
+        if grouped:
+            counts[grouped[0]][getattr(row, grouped[0]) or "N/A"] = row.count
+        else:
+            totals = row
+
+    result = {
+        "total": totals.count,
+        "with_geometry": totals.with_geometry,
+        "without_geometry": totals.count - totals.with_geometry,
+        "by_area": counts['area'],
+        "by_period": counts['periodo_iniziale'],
+        "by_type": counts['d_stratigrafica']
     }
+    stats_cache.set(cache_key, result)
+    return result
 
 
 @router.get("/{us_id}", response_model=USResponse)
-async def get_us(us_id: int, db: Session = Depends(get_db)):
+def get_us(us_id: int, db: Session = Depends(get_db)):
     """Get a specific stratigraphic unit by ID"""
-    us = db.query(US).filter(US.id_us == us_id).first()
-    if not us:
+    row = db.query(US, HAS_GEOMETRY).options(US_RESPONSE_COLUMNS).filter(US.id_us == us_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="US not found")
-    result = add_geometry_info([us], db)
-    return result[0] if result else us
+    return add_geometry_info([row])[0]
 
 
 @router.get("/by-number/{sito}/{area}/{us_number}", response_model=USResponse)
-async def get_us_by_number(sito: str, area: str, us_number: str, db: Session = Depends(get_db)):
+def get_us_by_number(sito: str, area: str, us_number: str, db: Session = Depends(get_db)):
     """Get a specific US by site, area and US number"""
-    us = db.query(US).filter(
+    row = db.query(US, HAS_GEOMETRY).options(US_RESPONSE_COLUMNS).filter(
         US.sito == sito,
         US.area == area,
         US.us == us_number
     ).first()
-    if not us:
+    if not row:
         raise HTTPException(status_code=404, detail="US not found")
-    result = add_geometry_info([us], db)
-    return result[0] if result else us
+    return add_geometry_info([row])[0]
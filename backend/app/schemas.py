@@ -1,11 +1,17 @@
 """
 Pydantic schemas for API request/response validation
 """
-from pydantic import BaseModel
-from typing import Optional, List, Any, Union
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Generic, TypeVar
 from datetime import date
 
 
+# Response models are read from ORM objects; their validators are built on first
+# use rather than on import, for the endpoints that a worker never serves
+RESPONSE_MODEL_CONFIG = ConfigDict(from_attributes=True, defer_build=True)
+
+
 # Site schemas
 class SiteBase(BaseModel):
     sito: Optional[str] = None
@@ -20,8 +26,7 @@ class SiteBase(BaseModel):
 class SiteResponse(SiteBase):
     id_sito: int
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
 
 
 # US schemas
@@ -51,8 +56,7 @@ class USResponse(USBase):
     id_us: int
     has_geometry: Optional[bool] = None  # Indicates if US has GIS geometry
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
 
 
 # Inventario Materiali schemas
@@ -81,8 +85,7 @@ class MaterialeBase(BaseModel):
 class MaterialeResponse(MaterialeBase):
     id_invmat: int
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
 
 
 # Pottery schemas - updated to match pottery_table structure
@@ -124,8 +127,7 @@ class PotteryResponse(PotteryBase):
     id_rep: int
     has_drawing: Optional[bool] = None  # Computed from drawing field
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
 
 
 # Media schemas
@@ -140,8 +142,29 @@ class MediaResponse(BaseModel):
     thumbnail_url: Optional[str] = None
     full_url: Optional[str] = None
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
+
+
+# Media types and file extensions of each category, also matched in SQL by the media router
+IMAGE_MEDIATYPES = ('image', 'foto', 'photo', 'img')
+VIDEO_MEDIATYPES = ('video', 'movie', 'film')
+MODEL_MEDIATYPES = ('3d', 'model', '3dmodel', 'mesh')
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff', 'tif')
+VIDEO_EXTENSIONS = ('mp4', 'webm', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'm4v')
+MODEL_EXTENSIONS = ('glb', 'gltf', 'obj', 'fbx', 'stl', 'ply', '3ds', 'dae')
+
+
+# Category of each media type and extension, looked up once per media
+MEDIATYPE_CATEGORIES = {
+    **dict.fromkeys(IMAGE_MEDIATYPES, "image"),
+    **dict.fromkeys(VIDEO_MEDIATYPES, "video"),
+    **dict.fromkeys(MODEL_MEDIATYPES, "3d"),
+}
+EXTENSION_CATEGORIES = {
+    **dict.fromkeys(IMAGE_EXTENSIONS, "image"),
+    **dict.fromkeys(VIDEO_EXTENSIONS, "video"),
+    **dict.fromkeys(MODEL_EXTENSIONS, "3d"),
+}
 
 
 def get_media_category(filename: Optional[str], filetype: Optional[str], mediatype: Optional[str] = None) -> str:
@@ -151,67 +174,76 @@ def get_media_category(filename: Optional[str], filetype: Optional[str], mediaty
     """
     # First check the mediatype field (most reliable)
     if mediatype:
-        mt = mediatype.lower().strip()
-        if mt in ('image', 'foto', 'photo', 'img'):
-            return "image"
-        elif mt in ('video', 'movie', 'film'):
-            return "video"
-        elif mt in ('3d', 'model', '3dmodel', 'mesh'):
-            return "3d"
+        category = MEDIATYPE_CATEGORIES.get(mediatype.lower().strip())
+        if category:
+            return category
 
     # Fallback: check extension from filetype or filename
     ext = ""
     if filetype:
         ext = filetype.lower().lstrip('.')
     elif filename:
-        ext = filename.split('.')[-1].lower() if '.' in filename else ""
-
-    # Image extensions
-    if ext in ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff', 'tif'):
-        return "image"
-    # Video extensions
-    elif ext in ('mp4', 'webm', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'm4v'):
-        return "video"
-    # 3D model extensions
-    elif ext in ('glb', 'gltf', 'obj', 'fbx', 'stl', 'ply', '3ds', 'dae'):
-        return "3d"
+        ext = filename.rpartition('.')[2].lower() if '.' in filename else ""
 
     # Default to image
-    return "image"
+    return EXTENSION_CATEGORIES.get(ext, "image")
 
 
 # Summary schemas for materials inventory
 class BoxSummary(BaseModel):
-    nr_cassa: Union[int, str]  # can be int or string representation
+    nr_cassa: int  # bigint in DB, 0 for the materials not in a numbered box
     luogo_conservazione: Optional[str] = None
     total_items: int
-    types: List[str] = []
+    types: List[str] = Field(default_factory=list)
 
 
 class StorageSummary(BaseModel):
     luogo_conservazione: str
     total_boxes: int
     total_items: int
-    boxes: List[BoxSummary] = []
+    boxes: List[BoxSummary] = Field(default_factory=list)
 
 
 class MaterialsSummary(BaseModel):
     total_materials: int
     total_boxes: int
-    storage_locations: List[StorageSummary] = []
-    by_type: dict = {}
-    by_site: dict = {}
+    storage_locations: List[StorageSummary] = Field(default_factory=list)
+    by_type: dict = Field(default_factory=dict)
+    by_site: dict = Field(default_factory=dict)
+
 
+# Pagination, of a listing of T
+T = TypeVar('T', bound=BaseModel)
 
-# Pagination
-class PaginatedResponse(BaseModel):
-    items: List[Any]
+
+class PaginatedResponse(BaseModel, Generic[T]):
+    items: List[T]
     total: int
     page: int
     page_size: int
     total_pages: int
 
 
+class CursorPaginatedResponse(PaginatedResponse[T], Generic[T]):
+    next_cursor: Optional[str] = None  # pass as cursor to get the next page by key
+
+
+def paginated_orjson(items: List[dict], total: int, page: int, page_size: int, **extra) -> ORJSONResponse:
+    """A page of a listing as a PaginatedResponse body, serialized directly
+
+    The items are dicts already shaped as the listing's response model, so the
+    page is not validated against the response_model again on the way out
+    """
+    return ORJSONResponse({
+        "items": items,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size,
+        **extra
+    })
+
+
 # Export request
 class ExportRequest(BaseModel):
     entity_type: str  # 'us', 'materiali', 'pottery', 'site'
@@ -249,8 +281,7 @@ class UserResponse(UserBase):
     id: int
     is_active: bool
 
-    class Config:
-        from_attributes = True
+    model_config = RESPONSE_MODEL_CONFIG
 
 
 class UserUpdate(BaseModel):
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Create the indexes used by the web app's listings, exports and logins
+The PyArchInit database is created by the desktop application, so the indexes
+declared on the models are not created automatically; run this once against
+the database (DATABASE_URL). Existing indexes are left untouched.
+"""
+
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from app.database import engine  # noqa: E402
+from app.models import Site, US, InventarioMateriali, Pottery, User  # noqa: E402
+
+# Trigram indexes for the ILIKE '%...%' filters, need the pg_trgm extension
+TRGM_INDEXES = {
+    'ix_pottery_table_ware_trgm': "pottery_table USING gin (ware gin_trgm_ops)",
+    # Pottery search matches note, form or specific form
+    'ix_pottery_table_note_trgm': "pottery_table USING gin (note gin_trgm_ops)",
+    'ix_pottery_table_form_trgm': "pottery_table USING gin (form gin_trgm_ops)",
+    'ix_pottery_table_specific_form_trgm': "pottery_table USING gin (specific_form gin_trgm_ops)",
+    # US search matches description, interpretation or stratigraphic definition
+    'ix_us_table_descrizione_trgm': "us_table USING gin (descrizione gin_trgm_ops)",
+    'ix_us_table_interpretazione_trgm': "us_table USING gin (interpretazione gin_trgm_ops)",
+    'ix_us_table_d_stratigrafica_trgm': "us_table USING gin (d_stratigrafica gin_trgm_ops)",
+    # Site search by name
+    'ix_site_table_sito_trgm': "site_table USING gin (sito gin_trgm_ops)",
+    # Media search by filename
+    'ix_media_thumb_table_media_filename_trgm': "media_thumb_table USING gin (media_filename gin_trgm_ops)",
+    # Materials search matches either column, the planner ORs the two index scans
+    'ix_inventario_materiali_table_descrizione_trgm':
+        "inventario_materiali_table USING gin (descrizione gin_trgm_ops)",
+    'ix_inventario_materiali_table_definizione_trgm':
+        "inventario_materiali_table USING gin (definizione gin_trgm_ops)",
+}
+
+# Index that would fail on accounts whose usernames differ only by case
+USERNAME_INDEX = 'ix_users_username_lower'
+
+
+def find_username_collisions(conn):
+    """Usernames shared by several accounts once case is ignored, with the accounts' spellings"""
+    return conn.execute(text(
+        "SELECT lower(username), array_agg(username ORDER BY id) FROM users "
+        "GROUP BY lower(username) HAVING count(*) > 1"
+    )).all()
+
+
+def create_model_indexes(conn):
+    """Create the indexes declared on the models
+
+    Returns False if the unique username index was skipped because of colliding accounts
+    """
+    collisions = find_username_collisions(conn)
+    for model in (Site, US, InventarioMateriali, Pottery, User):
+        for index in model.__table__.indexes:
+            if index.name == USERNAME_INDEX and collisions:
+                print(f"Skipping {index.name}: these accounts differ only by case, rename or remove them first")
+                for username, accounts in collisions:
+                    print(f"  {username}: {', '.join(accounts)}")
+                continue
+            print(f"Creating {index.name}")
+            index.create(conn, checkfirst=True)
+    return not collisions
+
+
+def create_trgm_indexes(conn):
+    """Create the trigram indexes, skipped when pg_trgm is not available"""
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for name, definition in TRGM_INDEXES.items():
+                print(f"Creating {name}")
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+    except Exception as e:
+        print(f"Skipping trigram indexes: {e}")
+
+
+if __name__ == "__main__":
+    with engine.begin() as conn:
+        complete = create_model_indexes(conn)
+        create_trgm_indexes(conn)
+    print("Done" if complete else "Done, except for the indexes skipped above")
+    sys.exit(0 if complete else 1)
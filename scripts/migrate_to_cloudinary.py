@@ -11,27 +11,59 @@ import sys
 sys.stdout.reconfigure(line_buffering=True)
 import cloudinary
 import cloudinary.uploader
+import cloudinary.api
 import psycopg2
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from itertools import islice
+import argparse
+import sqlite3
 import time
 
-# Configuration
-CLOUDINARY_CLOUD_NAME = "dkioeufik"
-CLOUDINARY_API_KEY = "531811383456143"
-CLOUDINARY_API_SECRET = "TZ8qlfL3_1M75okhTL2XmP4X_ZY"
+# Configuration; the API credentials are read from the environment
+CLOUDINARY_CLOUD_NAME = os.environ.get("CLOUDINARY_CLOUD_NAME", "dkioeufik")
+CLOUDINARY_API_KEY = os.environ.get("CLOUDINARY_API_KEY")
+CLOUDINARY_API_SECRET = os.environ.get("CLOUDINARY_API_SECRET")
 
 # Local paths
 PHOTOLOG_BASE = "/Volumes/TOSHIBA EXT/khtum2023/photolog"
 THUMBNAIL_PATH = os.path.join(PHOTOLOG_BASE, "thumbnail")
 ORIGINAL_PATH = os.path.join(PHOTOLOG_BASE, "original")
 
+# Uploads in flight at once; each one mostly waits on Cloudinary
+DEFAULT_CONCURRENCY = 16
+
+# Media rows fetched per round trip from the server-side cursor
+FETCH_SIZE = 5000
+
+# Files larger than this are uploaded in chunks, streamed from disk instead of
+# sent in a single request
+LARGE_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_CHUNK_SIZE = 6_000_000  # Cloudinary's minimum chunk size
+
+# Cloudinary folder of the thumbnails
+THUMBNAIL_FOLDER = "pyarchinit/thumbnails"
+
+# Public ids looked up per Admin API call, the most resources_by_ids accepts
+EXISTING_BATCH_SIZE = 100
+
+# Checkpoint of the uploaded media, so that an interrupted migration resumes
+STATE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migration_state.db")
+CHECKPOINT_EVERY = 100  # uploads recorded per commit
+
 # Database connection (local)
 DB_CONFIG = {
     "host": "localhost",
     "port": 5433,
     "database": "pyarchinit",
     "user": "postgres",
-    "password": "postgres"
+    "password": "postgres",
+    # The connection idles while a long migration uploads; TCP keepalives
+    # stop it from being dropped along the way
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3
 }
 
 # Configure Cloudinary
@@ -43,47 +75,108 @@ cloudinary.config(
 )
 
 
-def get_all_media(conn):
-    """Get ALL UNIQUE media, deduplicating by id_media"""
+def count_media(conn):
+    """Number of unique media IDs"""
     cursor = conn.cursor()
+    cursor.execute("SELECT count(DISTINCT id_media) FROM media_thumb_table")
+    return cursor.fetchone()[0]
+
+
+def get_all_media(conn):
+    """Yield ALL UNIQUE media, deduplicating by id_media, as (id_media, variants) rows
+
+    The database groups the rows, so each id_media comes back once with all its
+    variants, [media_filename, filepath, path_resize] lists kept so we can pick the
+    one that exists on disk. The cursor's rows are yielded as they are, without
+    repacking each variant. Rows are read through a server-side cursor,
+    FETCH_SIZE at a time, so memory stays flat however large the media table is
+    """
+    cursor = conn.cursor(name="media_stream")
+    cursor.itersize = FETCH_SIZE
     cursor.execute("""
-        SELECT mt.id_media, mt.media_filename, mt.filepath, mt.path_resize
+        SELECT mt.id_media,
+               array_agg(ARRAY[mt.media_filename, mt.filepath, mt.path_resize] ORDER BY mt.id_media_thumb)
         FROM media_thumb_table mt
+        GROUP BY mt.id_media
         ORDER BY mt.id_media
     """)
 
-    # Deduplicate by id_media, keeping all variants so we can pick the one that exists
-    media_dict = {}
-    for row in cursor.fetchall():
-        id_media = row[0]
-        if id_media not in media_dict:
-            media_dict[id_media] = []
-        media_dict[id_media].append(row)
+    yield from cursor
+    cursor.close()
+
+
+class FolderIndex:
+    """The files under a folder, by path relative to it, looked up without stat() calls
+
+    Paths are matched exactly first. The drive's filesystem may match names
+    regardless of case, so a path that misses falls back to the one file whose
+    path differs only by case; when several do, nothing is guessed
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.folded = {}
+        for relpath, full_path in files.items():
+            key = relpath.casefold()
+            # None marks a case-folded path shared by several files
+            self.folded[key] = None if key in self.folded else full_path
+
+    def __len__(self):
+        return len(self.files)
+
+    def get(self, relpath):
+        """Full path of the file at relpath, or of its only case-insensitive match"""
+        full_path = self.files.get(relpath)
+        if full_path is None:
+            full_path = self.folded.get(relpath.casefold())
+        return full_path
+
 
-    return media_dict
+def index_folder(folder_path):
+    """Index the files under a folder, by normalized path relative to it
+
+    One directory walk up front replaces the stat() calls of looking up each file,
+    which dominate on a slow external drive
+    """
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(folder_path):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            files[os.path.normpath(os.path.relpath(full_path, folder_path))] = full_path
+    return FolderIndex(files)
 
 
-def find_file_on_disk(filepath, folder_path):
-    """Find a file on disk, handling various naming conventions"""
+def find_file_on_disk(filepath, folder_index):
+    """Find a file in an indexed folder, handling various naming conventions"""
     if not filepath:
         return None
 
-    full_path = os.path.join(folder_path, filepath)
-    if os.path.exists(full_path):
-        return full_path
+    if os.path.isabs(filepath):
+        # An absolute path is looked up as is, outside the folder
+        if os.path.exists(filepath):
+            return filepath
+    else:
+        full_path = folder_index.get(os.path.normpath(filepath))
+        if full_path:
+            return full_path
 
     # Try without path prefix
-    filename = os.path.basename(filepath)
-    full_path = os.path.join(folder_path, filename)
-    if os.path.exists(full_path):
-        return full_path
-
-    return None
+    return folder_index.get(os.path.basename(filepath))
 
 
 def upload_to_cloudinary(file_path, public_id, folder, resource_type="image"):
-    """Upload a file to Cloudinary"""
+    """Upload a file to Cloudinary, in chunks if it is large"""
     try:
+        if os.path.getsize(file_path) > LARGE_FILE_SIZE:
+            return cloudinary.uploader.upload_large(
+                file_path,
+                chunk_size=UPLOAD_CHUNK_SIZE,
+                public_id=public_id,
+                folder=folder,
+                resource_type=resource_type,
+                overwrite=True,
+                invalidate=True
+            )
         result = cloudinary.uploader.upload(
             file_path,
             public_id=public_id,
@@ -98,30 +191,64 @@ def upload_to_cloudinary(file_path, public_id, folder, resource_type="image"):
         return None
 
 
-def find_best_file_for_media(media_variants, thumbnail_path, original_path):
+def open_state(path):
+    """Open the checkpoint database, and the set of media ids it records as done"""
+    state = sqlite3.connect(path)
+    state.execute("CREATE TABLE IF NOT EXISTS done(id_media INT PRIMARY KEY, public_id TEXT, uploaded_at REAL)")
+    return state, {row[0] for row in state.execute("SELECT id_media FROM done")}
+
+
+def get_existing_thumbnails(public_ids):
+    """The thumbnails among the given public ids that are already on Cloudinary
+
+    Asked EXISTING_BATCH_SIZE at a time through the Admin API; a failed lookup
+    only means those thumbnails get uploaded again
+    """
+    public_ids = [f"{THUMBNAIL_FOLDER}/{public_id}" for public_id in public_ids]
+    existing = set()
+    for start in range(0, len(public_ids), EXISTING_BATCH_SIZE):
+        try:
+            result = cloudinary.api.resources_by_ids(public_ids[start:start + EXISTING_BATCH_SIZE])
+        except Exception as e:
+            print(f"  Error checking existing thumbnails: {e}")
+            continue
+        existing.update(resource["public_id"] for resource in result["resources"])
+    return existing
+
+
+def find_best_file_for_media(id_media, media_variants, thumbnail_index, original_index):
     """
     Given multiple variants of the same id_media, find the one that has files on disk.
     Returns (id_media, media_filename, thumb_file, orig_file)
     """
-    for id_media, media_filename, filepath, path_resize in media_variants:
-        thumb_file = find_file_on_disk(filepath, thumbnail_path)
+    for media_filename, filepath, path_resize in media_variants:
+        thumb_file = find_file_on_disk(filepath, thumbnail_index)
 
         # Find original
         original_filepath = path_resize or filepath
         orig_file = None
         if original_filepath:
             original_name = original_filepath.replace("_thumb", "")
-            orig_file = find_file_on_disk(original_name, original_path)
+            orig_file = find_file_on_disk(original_name, original_index)
 
         # If we found at least one file, use this variant
         if thumb_file or orig_file:
             return (id_media, media_filename, thumb_file, orig_file)
 
     # No files found for any variant
-    return (media_variants[0][0], media_variants[0][1], None, None)
+    return (id_media, media_variants[0][0], None, None)
+
+
+def process_media(id_media, public_id, media_filename, thumb_file, orig_file):
+    """Upload a media's thumbnail, in a worker thread
+    Returns (id_media, public_id, media_filename, thumb_file, orig_file, uploaded, already_uploaded)
+    """
+    # Upload thumbnail only (originals stay on storage server to avoid size limits)
+    uploaded = upload_to_cloudinary(thumb_file, public_id, THUMBNAIL_FOLDER) is not None
+    return id_media, public_id, media_filename, thumb_file, orig_file, uploaded, False
 
 
-def migrate_media():
+def migrate_media(concurrency=DEFAULT_CONCURRENCY, reupload=False):
     """Main migration function"""
     print("=" * 60)
     print("PyArchInit Media Migration to Cloudinary")
@@ -133,6 +260,11 @@ def migrate_media():
         print("Make sure the external drive is connected.")
         sys.exit(1)
 
+    if not (CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET):
+        print("ERROR: Cloudinary credentials not set")
+        print("Set CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET in the environment.")
+        sys.exit(1)
+
     print(f"\nSource paths:")
     print(f"  Thumbnails: {THUMBNAIL_PATH}")
     print(f"  Originals:  {ORIGINAL_PATH}")
@@ -141,52 +273,70 @@ def migrate_media():
     print("\nConnecting to database...")
     try:
         conn = psycopg2.connect(**DB_CONFIG)
+        # Only read; the server-side cursor needs a transaction, so no autocommit
+        conn.set_session(readonly=True)
         print("  Connected!")
     except Exception as e:
         print(f"ERROR: Could not connect to database: {e}")
         sys.exit(1)
 
-    # Get ALL media (now returns dict keyed by id_media)
-    print("\nFetching all media...")
-    media_dict = get_all_media(conn)
-    total_unique = len(media_dict)
+    print("\nIndexing files on disk...")
+    thumbnail_index = index_folder(THUMBNAIL_PATH)
+    original_index = index_folder(ORIGINAL_PATH)
+    print(f"  {len(thumbnail_index)} thumbnails, {len(original_index)} originals")
+
+    print("\nCounting media...")
+    total_unique = count_media(conn)
     print(f"  Found {total_unique} unique media IDs")
 
+    # Media uploaded by previous runs are skipped without any lookup
+    state, done_ids = open_state(STATE_DB)
+    if reupload:
+        done_ids = set()
+    elif done_ids:
+        print(f"  Resuming: {len(done_ids)} already uploaded according to {STATE_DB}")
+    to_process = max(total_unique - len(done_ids), 0)
+
     # Statistics
     stats = {
         "total": total_unique,
         "thumbnails_found": 0,
         "thumbnails_uploaded": 0,
+        "thumbnails_existing": 0,
+        "resumed": 0,
         "originals_found": 0,
         "errors": 0,
         "skipped": 0
     }
 
-    # Process each unique media
-    print("\nStarting upload...")
+    # Process each unique media, several uploads in flight at once;
+    # the statistics are only updated here, as the results come back
+    print(f"\nStarting upload ({concurrency} concurrent)...")
     print("-" * 60)
 
     start_time = time.time()
-    media_ids = sorted(media_dict.keys())
+    completed = 0
+    recorded = 0
 
-    for i, id_media in enumerate(media_ids):
-        variants = media_dict[id_media]
-        progress = f"[{i+1}/{total_unique}]"
+    def report(result):
+        nonlocal completed, recorded
+        id_media, public_id, media_filename, thumb_file, orig_file, uploaded, already_uploaded = result
+        completed += 1
+        progress = f"[{completed}/{to_process}]"
 
-        # Find the best variant (one with files on disk)
-        id_media, media_filename, thumb_file, orig_file = find_best_file_for_media(
-            variants, THUMBNAIL_PATH, ORIGINAL_PATH
-        )
+        if uploaded or already_uploaded:
+            state.execute("INSERT OR IGNORE INTO done VALUES (?, ?, ?)", (id_media, public_id, time.time()))
+            recorded += 1
+            if recorded % CHECKPOINT_EVERY == 0:
+                state.commit()
 
-        # Upload thumbnail only (originals stay on storage server to avoid size limits)
         if thumb_file:
             stats["thumbnails_found"] += 1
-            public_id = f"thumb/{id_media}_{media_filename}"
-            print(f"{progress} Uploading thumbnail: {os.path.basename(thumb_file)}")
-
-            result = upload_to_cloudinary(thumb_file, public_id, "pyarchinit/thumbnails")
-            if result:
+            if uploaded:
                 stats["thumbnails_uploaded"] += 1
+                print(f"{progress} Uploaded thumbnail: {os.path.basename(thumb_file)}")
+            elif already_uploaded:
+                stats["thumbnails_existing"] += 1
             else:
                 stats["errors"] += 1
         else:
@@ -197,13 +347,53 @@ def migrate_media():
             stats["originals_found"] += 1
 
         # Progress update every 100 files
-        if (i + 1) % 100 == 0:
+        if completed % 100 == 0:
             elapsed = time.time() - start_time
-            rate = (i + 1) / elapsed
-            remaining = (total_unique - i - 1) / rate if rate > 0 else 0
-            print(f"\n  Progress: {i+1}/{total_unique} ({(i+1)/total_unique*100:.1f}%)")
+            rate = completed / elapsed
+            remaining = (to_process - completed) / rate if rate > 0 else 0
+            print(f"\n  Progress: {completed}/{to_process} ({completed/max(to_process, 1)*100:.1f}%)")
             print(f"  Elapsed: {elapsed/60:.1f} min, Remaining: ~{remaining/60:.1f} min\n")
 
+    # Media are resolved on disk as they stream in from the database, and only
+    # the uploads go to the workers, keeping a few per worker queued so that
+    # memory doesn't grow with the table. Media are read in batches, whose
+    # thumbnails already on Cloudinary (from a previous run) are looked up
+    # together; those and the media without files are counted right away
+    media = get_all_media(conn)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            for batch in iter(lambda: list(islice(media, EXISTING_BATCH_SIZE)), []):
+                fresh = [(id_media, variants) for id_media, variants in batch if id_media not in done_ids]
+                stats["resumed"] += len(batch) - len(fresh)
+                batch = fresh
+                existing = set() if reupload else get_existing_thumbnails(
+                    f"thumb/{id_media}_{variant[0]}" for id_media, variants in batch for variant in variants
+                )
+                for id_media, variants in batch:
+                    id_media, media_filename, thumb_file, orig_file = find_best_file_for_media(
+                        id_media, variants, thumbnail_index, original_index
+                    )
+                    public_id = f"thumb/{id_media}_{media_filename}"
+                    if not thumb_file or f"{THUMBNAIL_FOLDER}/{public_id}" in existing:
+                        report((id_media, public_id, media_filename, thumb_file, orig_file, False, bool(thumb_file)))
+                        continue
+
+                    if len(pending) >= 2 * concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            report(future.result())
+                    pending.add(executor.submit(
+                        process_media, id_media, public_id, media_filename, thumb_file, orig_file
+                    ))
+
+            for future in as_completed(pending):
+                report(future.result())
+    finally:
+        # Also on an interruption, so that the uploads done so far are kept
+        state.commit()
+        state.close()
+
     # Final statistics
     elapsed = time.time() - start_time
     print("\n" + "=" * 60)
@@ -213,6 +403,8 @@ def migrate_media():
     print(f"  Total unique media IDs: {stats['total']}")
     print(f"  Thumbnails found: {stats['thumbnails_found']}")
     print(f"  Thumbnails uploaded: {stats['thumbnails_uploaded']}")
+    print(f"  Thumbnails already on Cloudinary: {stats['thumbnails_existing']}")
+    print(f"  Already uploaded by previous runs: {stats['resumed']}")
     print(f"  Originals found (not uploaded): {stats['originals_found']}")
     print(f"  Skipped (no files): {stats['skipped']}")
     print(f"  Errors: {stats['errors']}")
@@ -229,22 +421,28 @@ def migrate_media():
 
 
 if __name__ == "__main__":
-    # Check for dry-run flag
-    if "--dry-run" in sys.argv:
+    parser = argparse.ArgumentParser(description="Upload media thumbnails to Cloudinary")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would be uploaded")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"uploads in flight at once (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--reupload", action="store_true",
+                        help="upload thumbnails already on Cloudinary, or uploaded by previous runs, again")
+    args = parser.parse_args()
+
+    if args.dry_run:
         print("DRY RUN MODE - No files will be uploaded")
         # Just show what would be done
         conn = psycopg2.connect(**DB_CONFIG)
-        media_dict = get_all_media(conn)
-        print(f"Would upload {len(media_dict)} unique media IDs")
+        thumbnail_index = index_folder(THUMBNAIL_PATH)
+        original_index = index_folder(ORIGINAL_PATH)
+        print(f"Would upload {count_media(conn)} unique media IDs")
 
         found_thumbs = 0
         found_origs = 0
-        media_ids = sorted(media_dict.keys())[:20]
 
-        for id_media in media_ids:
-            variants = media_dict[id_media]
-            id_m, filename, thumb_file, orig_file = find_best_file_for_media(
-                variants, THUMBNAIL_PATH, ORIGINAL_PATH
+        for id_media, variants in islice(get_all_media(conn), 20):
+            id_media, filename, thumb_file, orig_file = find_best_file_for_media(
+                id_media, variants, thumbnail_index, original_index
             )
             if thumb_file:
                 found_thumbs += 1
@@ -255,4 +453,4 @@ if __name__ == "__main__":
         print(f"\nSample (first 20): {found_thumbs} thumbs, {found_origs} origs found")
         conn.close()
     else:
-        migrate_media()
+        migrate_media(args.concurrency, args.reupload)